@@ -0,0 +1,552 @@
+""" Benchmarks for the scraping and loading pipeline
+
+Usage: python benchmarks.py [benchmark_name ...]. Runs every benchmark if none are named.
+"""
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import csv
+import glob
+
+import getters
+from global_merger import SEASONS, SEASON_ENCODINGS
+import storage
+import understat
+from parsers import parse_player_history, parse_player_gw_history
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """ Serves fake element-summary payloads after a fixed latency
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    latency = 0.05
+
+    bytes_sent = 0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        match = re.match(r'.*/element-summary/(\d+)/$', self.path)
+        if match is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        player_id = int(match.group(1))
+        history = [{'element': player_id, 'round': r, 'total_points': r % 7} for r in range(1, 39)]
+        history_past = [{'element_code': player_id, 'season_name': '2020/21', 'total_points': 100}]
+        body = json.dumps({'history': history, 'history_past': history_past, 'fixtures': []}).encode('utf-8')
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        StubHandler.bytes_sent += len(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer:
+    """ Local HTTP server running `handler` on a background thread
+    """
+    def __init__(self, handler=StubHandler):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:" + str(self.server.server_address[1]) + "/api/"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def best_time(run, repeat):
+    """ Fastest of `repeat` timed calls of run, in seconds
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_concurrent_fetch(num_players=200, worker_counts=(1, 2, 4, 8, 16, 32)):
+    """ Wall-clock time of the element-summary stage against a stub server as workers grow
+    """
+    original_url = getters.BASE_URL
+    with StubServer() as stub, tempfile.TemporaryDirectory() as tmp:
+        getters.BASE_URL = stub.url
+        try:
+            print("element-summary fetch, %d players, %.0fms latency" % (num_players, StubHandler.latency * 1000))
+            for workers in worker_counts:
+                start = time.perf_counter()
+                results = getters.get_individual_players_data(range(1, num_players + 1), workers)
+                for i, player_data in results:
+                    name = 'Player_' + str(i)
+                    parse_player_history(player_data["history_past"], tmp + '/', name, i)
+                    parse_player_gw_history(player_data["history"], tmp + '/', name, i)
+                elapsed = time.perf_counter() - start
+                assert [i for i, _ in results] == list(range(1, num_players + 1))
+                print("  workers=%-3d %7.2fs" % (workers, elapsed))
+        finally:
+            getters.BASE_URL = original_url
+
+
+def bench_response_cache(num_players=200, workers=8):
+    """ Cold, revalidated (304) and fresh-cache runs of the element-summary stage
+    """
+    original_url = getters.BASE_URL
+    with StubServer() as stub, tempfile.TemporaryDirectory() as tmp:
+        getters.BASE_URL = stub.url
+        cache = getters.enable_cache(os.path.join(tmp, 'cache'))
+        try:
+            print("response cache, %d players, %d workers" % (num_players, workers))
+            for label, ttl in (('cold', 900), ('fresh', 900), ('revalidate', 0)):
+                cache.ttl = ttl
+                StubHandler.bytes_sent = 0
+                start = time.perf_counter()
+                results = getters.get_individual_players_data(range(1, num_players + 1), workers)
+                elapsed = time.perf_counter() - start
+                assert len(results) == num_players
+                print("  %-10s %7.2fs %9d body bytes" % (label, elapsed, StubHandler.bytes_sent))
+        finally:
+            getters.disable_cache()
+            getters.BASE_URL = original_url
+
+
+def encode_understat_blob(obj):
+    """ json in the \\xNN-escaped form Understat embeds in its pages
+    """
+    text = json.dumps(obj, ensure_ascii=False)
+    return ''.join(c if c.isalnum() or ord(c) > 127 else '\\x%02X' % ord(c) for c in text)
+
+def understat_page(blobs):
+    """ Stand-in for a saved Understat page with one script per data blob
+    """
+    parts = ['<html><head><title>Understat</title></head><body>']
+    parts += ['<div class="filler">' + 'x' * 200 + '</div>'] * 50
+    for name, obj in blobs.items():
+        parts += ["<script>\n\tvar " + name + "\t= JSON.parse('" + encode_understat_blob(obj) + "');\n</script>"]
+    parts += ['</body></html>']
+    return '\n'.join(parts)
+
+def legacy_extract_json_vars(html, names):
+    """ The BeautifulSoup and split('=') path understat used before extract_json_vars
+    """
+    found = {}
+    for script in understat.extract_scripts(html):
+        for c in script.contents:
+            split_data = c.split('=')
+            data = split_data[0].strip()
+            for name in names:
+                if data == 'var ' + name:
+                    content = re.findall(r'JSON\.parse\(\'(.*)\'\)', split_data[1])
+                    decoded_content = understat.codecs.escape_decode(content[0], "hex")[0].decode('utf-8')
+                    found[name] = json.loads(decoded_content)
+    return found
+
+def saved_understat_pages(season_path='data/2021-22/understat', limit=100):
+    """ Player pages rebuilt from the checked-in per-player Understat csvs
+    """
+    pages = []
+    for fpath in sorted(glob.glob(os.path.join(season_path, '*_*.csv')))[:limit]:
+        if os.path.basename(fpath).startswith('understat_'):
+            continue
+        with open(fpath, encoding='utf-8') as f:
+            matches = list(csv.DictReader(f))
+        shots = [dict(m, minute=str(i)) for i, m in enumerate(matches)]
+        groups = {'season': [{'season': '2021', 'games': str(len(matches))}]}
+        pages += [understat_page({'groupsData': groups, 'matchesData': matches, 'shotsData': shots})]
+    return pages
+
+def bench_understat_extract(pages_dir=None, repeat=3):
+    """ Current BeautifulSoup parse vs the single-pass extractor, on saved pages
+
+    Args:
+        pages_dir (str): Folder of saved Understat .html pages. Defaults to pages rebuilt
+            from the checked-in 2021-22 Understat csvs
+    """
+    if pages_dir:
+        pages = []
+        for fpath in sorted(glob.glob(os.path.join(pages_dir, '*.html'))):
+            with open(fpath, encoding='utf-8') as f:
+                pages += [f.read()]
+    else:
+        pages = saved_understat_pages()
+    names = ('teamsData', 'playersData', 'matchesData', 'shotsData', 'groupsData')
+    for html in pages:
+        assert understat.extract_json_vars(html, names) == legacy_extract_json_vars(html, names)
+    size = sum(len(html) for html in pages)
+    print("understat extraction, %d pages, %.1f MB" % (len(pages), size / 1e6))
+    for label, extract in (('beautifulsoup', legacy_extract_json_vars), ('extract_json_vars', understat.extract_json_vars)):
+        best = best_time(lambda: [extract(html, names) for html in pages], repeat)
+        print("  %-18s %7.3fs" % (label, best))
+
+
+def bench_columnar_load(repeat=3):
+    """ Loading every checked-in season's merged_gw from csv vs parquet and feather copies
+    """
+    import shutil
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_paths = []
+        for season, encoding in zip(SEASONS, SEASON_ENCODINGS):
+            source = os.path.join('data', season, 'gws', 'merged_gw.csv')
+            if not os.path.exists(source):
+                continue
+            csv_path = os.path.join(tmp, season + '.csv')
+            shutil.copy(source, csv_path)
+            csv_paths += [(csv_path, encoding)]
+        print("merged_gw load, %d seasons" % len(csv_paths))
+        for storage_format in ('csv',) + storage.COLUMNAR_FORMATS:
+            if storage_format != 'csv':
+                for csv_path, encoding in csv_paths:
+                    storage.convert_csv(csv_path, storage_format, encoding=encoding)
+            load = lambda: [storage.read_table(csv_path, encoding=encoding) for csv_path, encoding in csv_paths]
+            best = best_time(load, repeat)
+            frames = load()
+            memory = sum(df.memory_usage(deep=True).sum() for df in frames)
+            print("  %-8s %7.3fs %8.1f MB in memory" % (storage_format, best, memory / 1e6))
+            for csv_path, encoding in csv_paths:
+                if storage_format != 'csv':
+                    os.remove(storage.columnar_path(csv_path, storage_format))
+
+
+def bench_season_merge(repeat=3, worker_counts=(1, 3, 6)):
+    """ Serial per-season concat against the threaded, categorical load_seasons in global_merger
+    """
+    import pandas as pd
+    import global_merger
+    available = [(season, encoding) for season, encoding in zip(SEASONS, SEASON_ENCODINGS)
+                 if os.path.exists(os.path.join('data', season, 'gws', 'merged_gw.csv'))]
+    seasons = [season for season, encoding in available]
+    encodings = [encoding for season, encoding in available]
+
+    def serial():
+        df = pd.DataFrame()
+        for season, encoding in available:
+            data = storage.read_table(os.path.join('data', season, 'gws', 'merged_gw.csv'), encoding=encoding)
+            data['season'] = season
+            df = pd.concat([df, data], ignore_index=True, sort=False)
+        return df[global_merger.MERGED_COLUMNS]
+
+    expected = serial()
+    loaded = global_merger.load_seasons(seasons, encodings)[global_merger.MERGED_COLUMNS]
+    print("merged seasons load, %d seasons, %d rows, identical csv=%s" % (
+        len(seasons), len(expected), expected.to_csv() == loaded.to_csv()))
+    runs = [('serial', serial, expected)]
+    for workers in worker_counts:
+        runs += [('threads x%d' % workers,
+                  lambda workers=workers: global_merger.load_seasons(seasons, encodings, workers), loaded)]
+    for label, load, df in runs:
+        print("  %-11s %7.3fs %8.1f MB in memory" % (label, best_time(load, repeat), df.memory_usage(deep=True).sum() / 1e6))
+    print("  peak rss %.1f MB" % global_merger.peak_memory_mb())
+
+
+def legacy_get_player_agg_data(season_path):
+    """ DataUtils.get_player_agg_data as it was, with the path split made portable
+    """
+    import pandas as pd
+    df_res = pd.DataFrame()
+    for dirpath, dirnames, filenames in os.walk(os.path.join(season_path, 'players')):
+        if 'gw.csv' in filenames:
+            df = pd.read_csv(os.path.join(dirpath, 'gw.csv'))
+            filename_split = dirpath.split(os.sep)[-1].split('_')
+            df.insert(0, 'player_name', ' '.join(filename_split[0:-1]))
+            df.insert(0, 'player_id', int(filename_split[-1]))
+            df_res = pd.concat([df_res, df])
+    return df_res
+
+def legacy_get_player_understat_data(season_path):
+    """ DataUtils.get_player_understat_data as it was, with the path split made portable
+    """
+    import pandas as pd
+    df_res = pd.DataFrame()
+    for dirpath, dirnames, filenames in os.walk(os.path.join(season_path, 'understat')):
+        for filename in filenames:
+            if 'understat_' in filename:
+                continue
+            temp_path = os.path.join(dirpath, filename)
+            df = pd.read_csv(temp_path)
+            filename_split = temp_path.split(os.sep)[-1].split('_')
+            df.insert(0, 'player_name', ' '.join(filename_split[0:-1]))
+            df.insert(0, 'player_id', int(filename_split[-1][:-4]))
+            df_res = pd.concat([df_res, df])
+    return df_res
+
+def bench_player_loaders(season='2021-22', worker_counts=(1, 4, 16)):
+    """ The quadratic os.walk loaders vs single-concat DataUtils loaders on the real trees
+    """
+    from ht_analysis.datautils import DataUtils
+    du = DataUtils(season)
+    loaders = (
+        ('players', legacy_get_player_agg_data, du.get_player_agg_data),
+        ('understat', legacy_get_player_understat_data, du.get_player_understat_data),
+    )
+    print("player loaders, " + season)
+    for label, legacy, loader in loaders:
+        start = time.perf_counter()
+        expected = legacy(du.season_path)
+        print("  %-9s legacy      %7.2fs %6d rows" % (label, time.perf_counter() - start, len(expected)))
+        expected = expected.sort_values(['player_id', 'player_name'], kind='mergesort').reset_index(drop=True)
+        for workers in worker_counts:
+            start = time.perf_counter()
+            df = loader(workers=workers)
+            elapsed = time.perf_counter() - start
+            df = df.sort_values(['player_id', 'player_name'], kind='mergesort').reset_index(drop=True)
+            assert df.equals(expected)
+            print("  %-9s workers=%-3d %7.2fs" % (label, workers, elapsed))
+
+
+def legacy_get_gameweek_superset(du):
+    """ DataUtils.get_gameweek_superset as it was, with row-wise applies and dict replaces
+    """
+    import pandas as pd
+    d_id_link = du.get_understat_pl_link()
+    df_gw = du.get_gw_data()
+    df_us = du.get_player_understat_data()
+    df_us = df_us.replace({'player_id': d_id_link})
+    df_gw['kickoff_date'] = pd.to_datetime(df_gw['kickoff_time'])
+    df_us['date'] = pd.to_datetime(df_us['date'])
+    df_gw['kickoff_date'] = df_gw['kickoff_date'].dt.date
+    df_us['date'] = df_us['date'].dt.date
+    id_dict = du.get_player_id_list()
+    df_gw['player_id'] = df_gw['name']
+    df_gw = df_gw.replace({'player_id': id_dict})
+    temp_df = pd.merge(df_us, df_gw, how='inner',
+                       left_on=['player_id', 'date'], right_on=['player_id', 'kickoff_date'],
+                       suffixes=("_us", "_pl"))
+    temp_df['team'] = temp_df.apply(lambda x: x['h_team'] if x['was_home'] else x['a_team'], axis=1)
+    temp_df['opposition_team'] = temp_df.apply(lambda x: x['a_team'] if x['was_home'] else x['h_team'], axis=1)
+    temp_df['value'] = temp_df['value'] / 10
+    temp_df['kickoff_time'] = temp_df.apply(lambda x: pd.to_datetime(x['kickoff_time']).time(), axis=1)
+    return temp_df.dropna().reset_index(drop=True)
+
+def preloaded_datautils(season='2021-22'):
+    """ DataUtils whose source files are read once up front, so timings only cover the join
+    """
+    from ht_analysis.datautils import DataUtils
+
+    class PreloadedDataUtils(DataUtils):
+        def __init__(self):
+            super().__init__(season)
+            self.gw_data = DataUtils.get_gw_data(self)
+            self.understat_data = DataUtils.get_player_understat_data(self)
+
+        def get_gw_data(self):
+            return self.gw_data.copy()
+
+        def get_player_understat_data(self, workers=8):
+            return self.understat_data.copy()
+
+    return PreloadedDataUtils()
+
+def bench_gameweek_superset(season='2021-22', repeat=3):
+    """ Regression check and timings of the vectorized get_gameweek_superset join
+    """
+    import pandas as pd
+    du = preloaded_datautils(season)
+    expected = legacy_get_gameweek_superset(du)
+    pd.testing.assert_frame_equal(du.get_gameweek_superset(), expected)
+    print("gameweek superset, %s, %d rows, identical to the row-wise version" % (season, len(expected)))
+    for label, build in (('row-wise', lambda: legacy_get_gameweek_superset(du)), ('vectorized', du.get_gameweek_superset)):
+        print("  %-10s %7.3fs" % (label, best_time(build, repeat)))
+
+
+def bench_collect_gws(season='2021-22', process_counts=(None, 2, 4)):
+    """ Regression check and timings of collect_gws against one collect_gw per gameweek
+    """
+    import collector
+    import filecmp
+    import shutil
+    season_path = os.path.join('data', season)
+    players_dir = os.path.join(season_path, 'players')
+    xp_files = glob.glob(os.path.join(season_path, 'gws', 'xP*.csv'))
+    gws = sorted(int(os.path.basename(path)[2:-4]) for path in xp_files)
+    with tempfile.TemporaryDirectory() as tmp:
+        per_gw_dir = os.path.join(tmp, 'per_gw')
+        bulk_dir = os.path.join(tmp, 'bulk')
+        for out_dir in (per_gw_dir, bulk_dir):
+            os.makedirs(out_dir)
+            for path in xp_files:
+                shutil.copy(path, out_dir)
+        start = time.perf_counter()
+        for gw in gws:
+            collector.collect_gw(gw, players_dir, per_gw_dir, season_path)
+        print("collect %d gameweeks, %s" % (len(gws), season))
+        print("  %-12s %7.3fs" % ('per gameweek', time.perf_counter() - start))
+        for processes in process_counts:
+            start = time.perf_counter()
+            collector.collect_gws(players_dir, bulk_dir, gws, season_path, processes=processes)
+            elapsed = time.perf_counter() - start
+            identical = all(filecmp.cmp(os.path.join(per_gw_dir, 'gw%d.csv' % gw),
+                                        os.path.join(bulk_dir, 'gw%d.csv' % gw), shallow=False)
+                            for gw in gws)
+            label = 'bulk x%d' % processes if processes else 'bulk'
+            print("  %-12s %7.3fs  identical=%s" % (label, elapsed, identical))
+
+
+def available_seasons():
+    """ (season, encoding) pairs of the seasons with a merged_gw.csv checked in
+    """
+    return [(season, encoding) for season, encoding in zip(SEASONS, SEASON_ENCODINGS)
+            if os.path.exists(os.path.join('data', season, 'gws', 'merged_gw.csv'))]
+
+def merged_seasons_frame():
+    """ Every available season as global_merger loads them, before any cleaning
+    """
+    import global_merger
+    seasons = available_seasons()
+    df = global_merger.load_seasons([s for s, e in seasons], [e for s, e in seasons])
+    return df[global_merger.MERGED_COLUMNS]
+
+def legacy_filter_players_exist_latest(df, col='position'):
+    # the groupby-apply version, with group_keys=False so it still aligns on pandas 2+
+    df[col] = df.groupby('name', group_keys=False)[col].apply(lambda x: x.ffill().bfill())
+    return df[df[col].notnull()]
+
+def bench_filter_players(repeat=3):
+    """ Regression check and timings of the vectorized filter_players_exist_latest
+    """
+    import pandas as pd
+    import mergers
+    df = mergers.clean_players_name_string(merged_seasons_frame())
+    expected = legacy_filter_players_exist_latest(df.copy())
+    pd.testing.assert_frame_equal(mergers.filter_players_exist_latest(df.copy()), expected)
+    print("filter_players_exist_latest, %d seasons, %d of %d rows kept, identical to groupby-apply" % (
+        len(available_seasons()), len(expected), len(df)))
+    for label, run in (('apply', lambda: legacy_filter_players_exist_latest(df.copy())),
+                       ('transforms', lambda: mergers.filter_players_exist_latest(df.copy()))):
+        print("  %-10s %7.3fs" % (label, best_time(run, repeat)))
+
+
+def legacy_clean_players_name_string(df, col='name'):
+    # three full-column string passes, with the regex the old default regex=True applied
+    df[col] = df[col].astype(object).str.replace('_', ' ', regex=False)
+    df[col] = df[col].str.replace(r'\d+', '', regex=True)
+    df[col] = df[col].str.strip()
+    return df
+
+def bench_name_clean(repeat=3):
+    """ Regression check, timings and name column size of clean_players_name_string
+    """
+    import mergers
+    df = merged_seasons_frame().astype({'name': object})
+    expected = legacy_clean_players_name_string(df.copy())
+    cleaned = mergers.clean_players_name_string(df.copy())
+    identical = (expected['name'].values == cleaned['name'].astype(object).values).all()
+    print("clean_players_name_string, %d rows, %d distinct names, identical=%s" % (
+        len(df), cleaned['name'].nunique(), identical))
+    for label, run, result in (('str passes', lambda: legacy_clean_players_name_string(df.copy()), expected),
+                               ('per unique', lambda: mergers.clean_players_name_string(df.copy()), cleaned)):
+        print("  %-10s %7.3fs %8.2f MB name column" % (
+            label, best_time(run, repeat), result['name'].memory_usage(deep=True) / 1e6))
+
+
+def legacy_get_opponent_team_name(df):
+    # the string-key merge, which leaves season_x/season_y and team_x/team_y behind
+    import pandas as pd
+    df_team = pd.read_csv(os.path.join('data', 'master_team_list.csv'))
+    df['id'] = df['season'].astype(str) + '_' + df['opponent_team'].astype(str)
+    df_team['id'] = df_team['season'].astype(str) + '_' + df_team['team'].astype(str)
+    df = pd.merge(df, df_team, on='id', how='left')
+    return df.rename(columns={"team_name": "opp_team_name"})
+
+def bench_opponent_names(repeat=3):
+    """ Regression check and timings of the indexed get_opponent_team_name against the
+    string-key merge, compared on the columns global_merger exports
+    """
+    import mergers
+    df = merged_seasons_frame()
+    df = mergers.filter_players_exist_latest(mergers.clean_players_name_string(df))
+    exported = ['season_x', 'name', 'position', 'team_x', 'opponent_team', 'opp_team_name', 'GW']
+    expected = legacy_get_opponent_team_name(df.copy())[exported]
+    indexed = mergers.get_opponent_team_name(df.copy())
+    indexed = indexed.rename(columns={'season': 'season_x', 'team': 'team_x'}).reset_index(drop=True)[exported]
+    print("get_opponent_team_name, %d rows, identical export=%s" % (len(df), expected.to_csv() == indexed.to_csv()))
+    for label, run in (('merge', lambda: legacy_get_opponent_team_name(df.copy())),
+                       ('indexed', lambda: mergers.get_opponent_team_name(df.copy()))):
+        print("  %-8s %7.3fs" % (label, best_time(run, repeat)))
+
+
+def legacy_match_count(understat_dir, data_dir):
+    # players the exact first_name second_name matcher linked
+    import pandas as pd
+    ustat = pd.read_csv(os.path.join(understat_dir, 'understat_player.csv'))
+    fpl = pd.read_csv(os.path.join(data_dir, 'player_idlist.csv'))
+    return int(ustat['player_name'].isin(fpl['first_name'] + ' ' + fpl['second_name']).sum())
+
+def bench_match_ids(repeat=3):
+    """ The blocked fuzzy match_ids checked against every checked-in id_dict.csv
+    """
+    import pandas as pd
+    for season in SEASONS:
+        data_dir = os.path.join('data', season)
+        understat_dir = os.path.join(data_dir, 'understat')
+        reference_path = os.path.join(data_dir, 'id_dict.csv')
+        if not os.path.exists(reference_path) or not os.path.exists(os.path.join(understat_dir, 'understat_player.csv')):
+            continue
+        with tempfile.TemporaryDirectory() as tmp:
+            outfile = os.path.join(tmp, 'id_dict.csv')
+            elapsed = best_time(lambda: understat.match_ids(understat_dir, data_dir, outfile), repeat)
+            matched = pd.read_csv(outfile, skipinitialspace=True)
+        reference = pd.read_csv(reference_path, skipinitialspace=True)
+        reference = reference[(reference['Understat_ID'] >= 0) & (reference['FPL_ID'] >= 0)]
+        expected = dict(zip(reference['Understat_ID'], reference['FPL_ID']))
+        matched = matched[(matched['Understat_ID'] >= 0) & (matched['FPL_ID'] >= 0)]
+        judged = [(us_id, fpl_id) for us_id, fpl_id in zip(matched['Understat_ID'], matched['FPL_ID']) if us_id in expected]
+        correct = sum(expected[us_id] == fpl_id for us_id, fpl_id in judged)
+        print("match_ids %s, %.3fs" % (season, elapsed))
+        print("  exact names matched  %d" % legacy_match_count(understat_dir, data_dir))
+        print("  fuzzy matched        %d, %d of %d agree with the checked-in id_dict" % (len(matched), correct, len(judged)))
+        print("  lowest confidence    %.3f" % matched['Confidence'].min())
+
+
+BENCHMARKS = {
+    'concurrent_fetch': bench_concurrent_fetch,
+    'response_cache': bench_response_cache,
+    'understat_extract': bench_understat_extract,
+    'columnar_load': bench_columnar_load,
+    'season_merge': bench_season_merge,
+    'player_loaders': bench_player_loaders,
+    'gameweek_superset': bench_gameweek_superset,
+    'collect_gws': bench_collect_gws,
+    'filter_players': bench_filter_players,
+    'name_clean': bench_name_clean,
+    'opponent_names': bench_opponent_names,
+    'match_ids': bench_match_ids,
+}
+
+def main():
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print("Unknown benchmark " + name + ". Choose from: " + ", ".join(BENCHMARKS))
+            sys.exit(1)
+        BENCHMARKS[name]()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+class ResponseCache:
+    """ On-disk cache of HTTP response bodies keyed by url
+
+    Each entry is a body file plus a small json file holding the url, the ETag and
+    Last-Modified validators and when the body was last confirmed. Entries younger
+    than `ttl` seconds are served without touching the network; older ones are
+    revalidated with a conditional request. When the bodies grow past `max_bytes`
+    the least recently used entries are evicted.
+
+    Args:
+        directory (str): Folder the cache lives in
+        ttl (float): Seconds an entry is served without revalidating
+        max_bytes (int): Upper bound on the total size of cached bodies
+    """
+    def __init__(self, directory, ttl=900, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.total_bytes = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        base = os.path.join(self.directory, key)
+        return base + '.json', base + '.body'
+
+    def lookup(self, url):
+        """ Metadata for the cached copy of `url`, or None if there is none
+        """
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('url') != url or not os.path.exists(body_path):
+            return None
+        return entry
+
+    def is_fresh(self, entry):
+        return time.time() - entry['fetched_at'] < self.ttl
+
+    def conditional_headers(self, entry):
+        """ Request headers that let the server answer 304 for an unchanged `entry`
+        """
+        headers = {}
+        if entry is None:
+            return headers
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def read(self, url):
+        """ Cached body of `url`, or None if another thread has just evicted it. Touches
+        the body so eviction sees it as recently used
+        """
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(body_path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            os.utime(body_path)
+        except OSError:
+            return None
+        return text
+
+    def refresh(self, url, entry, headers=None):
+        """ Mark `entry` as confirmed unchanged by the server just now
+        """
+        entry['fetched_at'] = time.time()
+        if headers is not None:
+            entry['etag'] = headers.get('ETag', entry.get('etag'))
+            entry['last_modified'] = headers.get('Last-Modified', entry.get('last_modified'))
+        meta_path, body_path = self._paths(url)
+        self._write(meta_path, json.dumps(entry))
+
+    def store(self, url, text, headers):
+        """ Save a fresh 200 response body together with its validators
+        """
+        entry = {
+            'url': url,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'fetched_at': time.time(),
+        }
+        meta_path, body_path = self._paths(url)
+        with self.lock:
+            old_size = os.path.getsize(body_path) if os.path.exists(body_path) else 0
+            self._write(body_path, text)
+            self._write(meta_path, json.dumps(entry))
+            if self.total_bytes is None:
+                self.total_bytes = self._scan_size()
+            else:
+                self.total_bytes += os.path.getsize(body_path) - old_size
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _write(self, path, text):
+        tmp_path = path + '.' + str(threading.get_ident()) + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def _bodies(self):
+        for fname in os.listdir(self.directory):
+            if fname.endswith('.body'):
+                yield os.path.join(self.directory, fname)
+
+    def _stat_bodies(self):
+        """ (mtime, size, path) of every body still on disk, skipping any removed mid-scan
+        """
+        stats = []
+        for path in self._bodies():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            stats += [(stat.st_mtime, stat.st_size, path)]
+        return stats
+
+    def _scan_size(self):
+        return sum(size for mtime, size, path in self._stat_bodies())
+
+    def _evict(self):
+        """ Drop least recently used entries until the cache is back under a
+        tenth below `max_bytes`, so a full cache doesn't evict on every store
+        """
+        target = self.max_bytes * 0.9
+        for mtime, size, body_path in sorted(self._stat_bodies()):
+            if self.total_bytes <= target:
+                break
+            meta_path = body_path[:-len('.body')] + '.json'
+            for path in (body_path, meta_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self.total_bytes -= size
+
+    def clear(self):
+        with self.lock:
+            for fname in os.listdir(self.directory):
+                if fname.endswith('.body') or fname.endswith('.json'):
+                    os.remove(os.path.join(self.directory, fname))
+            self.total_bytes = 0
@@ -2,32 +2,60 @@ import csv
 import math
 import os
 
+CLEANED_HEADERS = ['first_name', 'second_name', 'goals_scored', 'assists', 'total_points', 'minutes', 'goals_conceded', 'creativity', 'influence', 'threat', 'bonus', 'bps', 'ict_index', 'clean_sheets', 'red_cards', 'yellow_cards', 'selected_by_percent', 'now_cost', 'element_type']
+ID_HEADERS = ['first_name', 'second_name', 'id']
+POSITIONS = {'1': 'GK', '2': 'DEF', '3': 'MID', '4': 'FWD'}
+
+def open_output(outname):
+    os.makedirs(os.path.dirname(outname), exist_ok=True)
+    return open(outname, 'w+', encoding='utf-8', newline='')
+
+def clean_player(line):
+    """ The cleaned_players.csv row for a players_raw.csv row, with element_type as a position name
+    """
+    line = dict(line)
+    if line['element_type'] in POSITIONS:
+        line['element_type'] = POSITIONS[line['element_type']]
+    else:
+        print("Oh boy")
+    return line
+
+def clean_and_id_players(players_filename, base_filename):
+    """ Reads players_raw.csv once, writing cleaned_players.csv and player_idlist.csv
+    from the same pass and returning the id to name map get_player_ids would read back
+
+    Args:
+        players_filename (str): Name of the file that contains the full data for each player
+        base_filename (str): Season folder the outputs are written to
+    """
+    player_ids = {}
+    with open(players_filename, 'r', encoding='utf-8', newline='') as fin, \
+            open_output(base_filename + 'cleaned_players.csv') as fclean, \
+            open_output(base_filename + 'player_idlist.csv') as fids:
+        reader = csv.DictReader(fin)
+        clean_writer = csv.DictWriter(fclean, CLEANED_HEADERS, extrasaction='ignore')
+        id_writer = csv.DictWriter(fids, ID_HEADERS, extrasaction='ignore')
+        clean_writer.writeheader()
+        id_writer.writeheader()
+        for line in reader:
+            clean_writer.writerow(clean_player(line))
+            id_writer.writerow(line)
+            player_ids[int(line['id'])] = line['first_name'] + '_' + line['second_name']
+    return player_ids
+
 def clean_players(filename, base_filename):
     """ Creates a file with only important data columns for each player
 
     Args:
         filename (str): Name of the file that contains the full data for each player
     """
-    headers = ['first_name', 'second_name', 'goals_scored', 'assists', 'total_points', 'minutes', 'goals_conceded', 'creativity', 'influence', 'threat', 'bonus', 'bps', 'ict_index', 'clean_sheets', 'red_cards', 'yellow_cards', 'selected_by_percent', 'now_cost', 'element_type']
-    fin = open(filename, 'r+', encoding='utf-8')
-    outname = base_filename + 'cleaned_players.csv'
-    os.makedirs(os.path.dirname(outname), exist_ok=True)
-    fout = open(outname, 'w+', encoding='utf-8', newline='')
-    reader = csv.DictReader(fin)
-    writer = csv.DictWriter(fout, headers, extrasaction='ignore')
-    writer.writeheader()
-    for line in reader:
-        if line['element_type'] == '1':
-            line['element_type'] = 'GK'
-        elif line['element_type'] == '2':
-            line['element_type'] = 'DEF'
-        elif line['element_type'] == '3':
-            line['element_type'] = 'MID'
-        elif line['element_type'] == '4':
-            line['element_type'] = 'FWD'
-        else:
-            print("Oh boy")
-        writer.writerow(line)
+    with open(filename, 'r', encoding='utf-8', newline='') as fin, \
+            open_output(base_filename + 'cleaned_players.csv') as fout:
+        reader = csv.DictReader(fin)
+        writer = csv.DictWriter(fout, CLEANED_HEADERS, extrasaction='ignore')
+        writer.writeheader()
+        for line in reader:
+            writer.writerow(clean_player(line))
 
 def id_players(players_filename, base_filename):
     """ Creates a file that contains the name to id mappings for each player
@@ -35,26 +63,36 @@ def id_players(players_filename, base_filename):
     Args:
         players_filename (str): Name of the file that contains the full data for each player
     """
-    headers = ['first_name', 'second_name', 'id']
-    fin = open(players_filename, 'r+', encoding='utf-8')
-    outname = base_filename + 'player_idlist.csv'
-    os.makedirs(os.path.dirname(outname), exist_ok=True)
-    fout = open(outname, 'w+', encoding='utf-8', newline='')
-    reader = csv.DictReader(fin)
-    writer = csv.DictWriter(fout, headers, extrasaction='ignore')
-    writer.writeheader()
-    for line in reader:
-        writer.writerow(line)
+    with open(players_filename, 'r', encoding='utf-8', newline='') as fin, \
+            open_output(base_filename + 'player_idlist.csv') as fout:
+        reader = csv.DictReader(fin)
+        writer = csv.DictWriter(fout, ID_HEADERS, extrasaction='ignore')
+        writer.writeheader()
+        for line in reader:
+            writer.writerow(line)
 
 def get_player_ids(base_filename):
     """ Gets the list of all player ids and player names
     """
     filename = base_filename + 'player_idlist.csv'
-    fin = open(filename, 'r+', encoding='utf-8')
-    reader = csv.DictReader(fin)
     player_ids = {}
-    for line in reader:
-        k = int(line['id'])
-        v = line['first_name'] + '_' + line['second_name']
-        player_ids[k] = v
+    with open(filename, 'r', encoding='utf-8', newline='') as fin:
+        reader = csv.DictReader(fin)
+        for line in reader:
+            k = int(line['id'])
+            v = line['first_name'] + '_' + line['second_name']
+            player_ids[k] = v
     return player_ids
+
+def get_player_snapshot(base_filename):
+    """ Gets the bootstrap-static fields recorded for each player id on the last run
+    """
+    filename = base_filename + 'players_snapshot.csv'
+    snapshot = {}
+    if not os.path.exists(filename):
+        return snapshot
+    with open(filename, 'r', encoding='utf-8') as fin:
+        reader = csv.DictReader(fin)
+        for line in reader:
+            snapshot[int(line['id'])] = line
+    return snapshot
@@ -1,24 +1,31 @@
 import os
 import sys
 import csv
+import io
+import json
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from players_gw import KEY_COLUMNS, read_player_gws_text
+from storage import mirror_csv
 
 def get_teams(directory):
     teams = {}
-    fin = open(directory + "/teams.csv", 'rU')
-    reader = csv.DictReader(fin)
-    for row in reader:
-        teams[int(row['id'])] = row['name']
+    with open(directory + "/teams.csv", 'r') as fin:
+        reader = csv.DictReader(fin)
+        for row in reader:
+            teams[int(row['id'])] = row['name']
     return teams
 
 
 def get_fixtures(directory):
     fixtures_home = {}
     fixtures_away = {}
-    fin = open(directory + "/fixtures.csv", 'rU')
-    reader = csv.DictReader(fin)
-    for row in reader:
-        fixtures_home[int(row['id'])] = int(row['team_h'])
-        fixtures_away[int(row['id'])] = int(row['team_a'])
+    with open(directory + "/fixtures.csv", 'r') as fin:
+        reader = csv.DictReader(fin)
+        for row in reader:
+            fixtures_home[int(row['id'])] = int(row['team_h'])
+            fixtures_away[int(row['id'])] = int(row['team_a'])
     return fixtures_home, fixtures_away
 
 
@@ -26,86 +33,301 @@ def get_positions(directory):
     positions = {}
     names = {}
     pos_dict = {'1': "GK", '2': "DEF", '3': "MID", '4': "FWD"}
-    fin = open(directory + "/players_raw.csv", 'rU',encoding="utf-8")
-    reader = csv.DictReader(fin)
-    for row in reader:
-        positions[int(row['id'])] = pos_dict[row['element_type']] 
-        names[int(row['id'])] = row['first_name'] + ' ' + row['second_name']
+    with open(directory + "/players_raw.csv", 'r', encoding="utf-8") as fin:
+        reader = csv.DictReader(fin)
+        for row in reader:
+            positions[int(row['id'])] = pos_dict[row['element_type']]
+            names[int(row['id'])] = row['first_name'] + ' ' + row['second_name']
     return names, positions
 
 def get_expected_points(gw, directory):
     xPoints = {}
-    fin = open(os.path.join(directory, 'xP' + str(gw) + '.csv'), 'rU')
-    reader = csv.DictReader(fin)
-    for row in reader:
-        xPoints[int(row['id'])] = row['xP']
+    with open(os.path.join(directory, 'xP' + str(gw) + '.csv'), 'r') as fin:
+        reader = csv.DictReader(fin)
+        for row in reader:
+            xPoints[int(row['id'])] = row['xP']
     return xPoints
 
+MERGED_GW_FILENAME = "merged_gw.csv"
+MERGED_GW_INDEX_FILENAME = "merged_gw_index.json"
+
+def scan_merged_gw(merged_path):
+    """ Byte offset of the first row of every GW in merged_gw.csv, read off the GW column
+
+    Each gameweek's rows must sit together in the file, as merge_gw writes them.
+    """
+    offsets = {}
+    last_gw = None
+    with open(merged_path, 'rb') as f:
+        offset = len(f.readline())
+        for line in f:
+            gw = int(line.rstrip(b'\r\n').rsplit(b',', 1)[-1])
+            if gw != last_gw:
+                if gw in offsets:
+                    raise Exception("GW " + str(gw) + " is split across " + merged_path + ", rebuild it with merge_all_gws")
+                offsets[gw] = offset
+                last_gw = gw
+            offset += len(line)
+    return offsets
+
+def read_merged_gw_index(gw_directory):
+    """ Offsets of each GW in merged_gw.csv, from the sidecar index when it still
+    describes the file on disk, otherwise from a scan of the file
+    """
+    merged_path = os.path.join(gw_directory, MERGED_GW_FILENAME)
+    if not os.path.exists(merged_path):
+        return {}
+    stat = os.stat(merged_path)
+    try:
+        with open(os.path.join(gw_directory, MERGED_GW_INDEX_FILENAME), 'r') as f:
+            index = json.load(f)
+        if index['size'] == stat.st_size and index['mtime_ns'] == stat.st_mtime_ns:
+            return {int(gw): offset for gw, offset in index['offsets'].items()}
+    except (OSError, ValueError, KeyError):
+        pass
+    return scan_merged_gw(merged_path)
+
+def write_merged_gw_index(gw_directory, offsets):
+    stat = os.stat(os.path.join(gw_directory, MERGED_GW_FILENAME))
+    index = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'offsets': offsets}
+    with open(os.path.join(gw_directory, MERGED_GW_INDEX_FILENAME), 'w') as f:
+        json.dump(index, f)
+
 def merge_gw(gw, gw_directory):
-    merged_gw_filename = "merged_gw.csv"
+    """ Put the rows of gwN.csv into merged_gw.csv, replacing any rows already there for gw
+
+    merged_gw.csv keeps gameweeks in ascending order and merged_gw_index.json records
+    where each one starts, so rerunning a gameweek rewrites only that gameweek and the
+    ones after it rather than duplicating its rows or rebuilding the whole file.
+    """
     gw_filename = "gw" + str(gw) + ".csv"
     gw_path = os.path.join(gw_directory, gw_filename)
-    fin = open(gw_path, 'rU', encoding="utf-8")
-    reader = csv.DictReader(fin)
-    fieldnames = reader.fieldnames
-    fieldnames += ["GW"]
-    rows = []
-    for row in reader:
-        row["GW"] = gw
-        rows += [row]
-    out_path = os.path.join(gw_directory, merged_gw_filename)
-    fout = open(out_path,'a', encoding="utf-8")
-    writer = csv.DictWriter(fout, fieldnames=fieldnames, lineterminator='\n')
+    with open(gw_path, 'r', encoding="utf-8") as fin:
+        reader = csv.DictReader(fin)
+        fieldnames = reader.fieldnames + ["GW"]
+        rows = []
+        for row in reader:
+            row["GW"] = gw
+            rows += [row]
     print(gw)
-    if gw == 1:
+    out_path = os.path.join(gw_directory, MERGED_GW_FILENAME)
+    offsets = read_merged_gw_index(gw_directory)
+    with open(out_path, 'r+b' if os.path.exists(out_path) else 'w+b') as fout:
+        header = fout.readline()
+        if header:
+            fieldnames = next(csv.reader([header.decode('utf-8')]))
+        body = io.StringIO()
+        writer = csv.DictWriter(body, fieldnames=fieldnames, restval='', lineterminator='\n')
+        if not header:
+            writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+        body = body.getvalue().encode('utf-8')
+        eof = fout.seek(0, os.SEEK_END)
+        if gw in offsets:
+            start = offsets[gw]
+            end = min([offset for offset in offsets.values() if offset > start], default=eof)
+        else:
+            start = end = min([offset for g, offset in offsets.items() if g > gw], default=eof)
+        fout.seek(end)
+        tail = fout.read()
+        fout.seek(start)
+        fout.write(body)
+        fout.write(tail)
+        fout.truncate()
+    shift = start + len(body) - end
+    if not header:
+        start += body.index(b'\n') + 1
+    offsets = {g: offset + shift if offset >= end else offset for g, offset in offsets.items() if g != gw}
+    if rows:
+        offsets[gw] = start
+    write_merged_gw_index(gw_directory, dict(sorted(offsets.items())))
+    mirror_csv(out_path)
+
+class GameweekLookups:
+    """ The season lookups collect_gw joins onto each player's gw.csv rows
+
+    Args:
+        root_directory_name (str): Season folder holding fixtures.csv, teams.csv and players_raw.csv
+    """
+    def __init__(self, root_directory_name):
+        self.fixtures_home, self.fixtures_away = get_fixtures(root_directory_name)
+        self.teams = get_teams(root_directory_name)
+        self.names, self.positions = get_positions(root_directory_name)
+
+    def decorate(self, row, id, xPoints):
+        """ Add the name, position, team and xP columns to a player's gw.csv row
+        """
+        fixture = int(row['fixture'])
+        if row['was_home'] == True or row['was_home'] == "True":
+            row['team'] = self.teams[self.fixtures_home[fixture]]
+        else:
+            row['team'] = self.teams[self.fixtures_away[fixture]]
+        row['name'] = self.names[id]
+        row['position'] = self.positions[id]
+        if id in xPoints:
+            row['xP'] = xPoints[id]
+        else:
+            row['xP'] = 0.0
+        return row
+
+def player_gw_dirs(directory_name):
+    """ Every folder under the players tree holding a gw.csv, in player id order
+
+    This is the row order GameweekBuilder writes, so every gwN.csv writer gives the
+    same file and rerunning a gameweek through merge_gw doesn't reshuffle its rows.
+    """
+    dirs = [root for root, dirs, files in os.walk(u"./" + directory_name) if 'gw.csv' in files]
+    return sorted(dirs, key=lambda root: int(os.path.basename(root).split('_')[-1]))
+
+def write_gw(gw, rows, fieldnames, output_dir):
+    fieldnames = ['name', 'position', 'team', 'xP'] + fieldnames
+    out_path = os.path.join(output_dir, "gw" + str(gw) + ".csv")
+    with open(out_path, 'w', encoding="utf-8") as outf:
+        writer = csv.DictWriter(outf, fieldnames=fieldnames, lineterminator='\n')
         writer.writeheader()
-    for row in rows:
-        writer.writerow(row)
+        for row in rows:
+            writer.writerow(row)
+    mirror_csv(out_path)
 
 def collect_gw(gw, directory_name, output_dir, root_directory_name="data/2021-22"):
     rows = []
     fieldnames = []
-    fixtures_home, fixtures_away = get_fixtures(root_directory_name)
-    teams = get_teams(root_directory_name)
-    names, positions = get_positions(root_directory_name)
+    lookups = GameweekLookups(root_directory_name)
     xPoints = get_expected_points(gw, output_dir)
-    for root, dirs, files in os.walk(u"./" + directory_name):
-        for fname in files:
-            if fname == 'gw.csv':
-                fpath = os.path.join(root, fname)
-                fin = open(fpath, 'rU')
-                reader = csv.DictReader(fin)
-                fieldnames = reader.fieldnames
-                for row in reader:
-                    if int(row['round']) == gw:
-                        id = int(os.path.basename(root).split('_')[-1])
-                        name = names[id]
-                        position = positions[id]
-                        fixture = int(row['fixture'])
-                        if row['was_home'] == True or row['was_home'] == "True":
-                            row['team'] = teams[fixtures_home[fixture]]
-                        else:
-                            row['team'] = teams[fixtures_away[fixture]]
-                        row['name'] = name
-                        row['position'] = position
-                        if id in xPoints:
-                            row['xP'] = xPoints[id]
-                        else:
-                            row['xP'] = 0.0
-                        rows += [row]
+    for root in player_gw_dirs(directory_name):
+        with open(os.path.join(root, 'gw.csv'), 'r') as fin:
+            reader = csv.DictReader(fin)
+            fieldnames = reader.fieldnames
+            for row in reader:
+                if int(row['round']) == gw:
+                    id = int(os.path.basename(root).split('_')[-1])
+                    rows += [lookups.decorate(row, id, xPoints)]
+    write_gw(gw, rows, fieldnames, output_dir)
 
-    fieldnames = ['name', 'position', 'team', 'xP'] + fieldnames
-    outf = open(os.path.join(output_dir, "gw" + str(gw) + ".csv"), 'w', encoding="utf-8")
-    writer = csv.DictWriter(outf, fieldnames=fieldnames, lineterminator='\n')
-    writer.writeheader()
-    for row in rows:
-        writer.writerow(row)
+def scan_player_gws(player_dirs, gws=None):
+    """ Read the gw.csv of each player folder once, routing every row to its gameweek
+
+    Args:
+        player_dirs (list): Player folders, as returned by player_gw_dirs
+        gws (set): Only keep rows of these gameweeks, or every gameweek if None
+
+    Returns:
+        The gw.csv header of the last file read, and a dict of gameweek to a list of
+        (player id, row) tuples in the order the folders were given
+    """
+    fieldnames = []
+    buffers = {}
+    for root in player_dirs:
+        id = int(os.path.basename(root).split('_')[-1])
+        with open(os.path.join(root, 'gw.csv'), 'r') as fin:
+            reader = csv.DictReader(fin)
+            fieldnames = reader.fieldnames
+            for row in reader:
+                gw = int(row['round'])
+                if gws is None or gw in gws:
+                    buffers.setdefault(gw, []).append((id, row))
+    return fieldnames, buffers
+
+def scan_player_gws_sharded(player_dirs, gws=None, processes=None):
+    """ scan_player_gws with the player folders split into contiguous shards read
+    by a process pool. Shards are merged back in order so rows keep the serial order
+    """
+    if not processes or processes < 2 or len(player_dirs) < 2:
+        return scan_player_gws(player_dirs, gws)
+    shard_size = -(-len(player_dirs) // processes)
+    shards = [player_dirs[i:i + shard_size] for i in range(0, len(player_dirs), shard_size)]
+    fieldnames = []
+    buffers = {}
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for shard_fieldnames, shard_buffers in executor.map(scan_player_gws, shards, [gws] * len(shards)):
+            fieldnames = shard_fieldnames or fieldnames
+            for gw, rows in shard_buffers.items():
+                buffers.setdefault(gw, []).extend(rows)
+    return fieldnames, buffers
+
+def collect_gws(directory_name, output_dir, gws=None, root_directory_name="data/2021-22", processes=None):
+    """ Bulk collect_gw: walk the players tree once and write every gwN.csv in one go
+
+    Gives the same files as calling collect_gw for each gameweek, without re-reading
+    every player's gw.csv per gameweek. Backfills that have a players_gw.csv table
+    should go through GameweekBuilder, which parse_data uses; this is for seasons
+    that only have the players/ tree.
+
+    Args:
+        directory_name (str): The players folder, e.g. 'data/2021-22/players'
+        output_dir (str): Folder holding the xPN.csv files that gwN.csv is written to
+        gws (list): Gameweeks to write, or every gameweek found in the tree if None
+        root_directory_name (str): Season folder holding the lookup csvs
+        processes (int): Read the player folders across this many processes
+    """
+    lookups = GameweekLookups(root_directory_name)
+    wanted = None if gws is None else set(gws)
+    fieldnames, buffers = scan_player_gws_sharded(player_gw_dirs(directory_name), wanted, processes)
+    for gw in sorted(buffers) if gws is None else gws:
+        xPoints = get_expected_points(gw, output_dir)
+        rows = [lookups.decorate(row, id, xPoints) for id, row in buffers.get(gw, [])]
+        write_gw(gw, rows, fieldnames, output_dir)
+
+class GameweekBuilder:
+    """ Builds gwN.csv files from the season-wide players_gw table
+
+    The fixtures, teams and players lookups are read once and joined onto every
+    row up front, and the rows are grouped by round, so each gameweek written is
+    a slice of an already-joined frame rather than a walk of the players tree.
+
+    Args:
+        root_directory_name (str): Season folder, e.g. 'data/2021-22'
+        output_dir (str): Folder holding the xPN.csv files that gwN.csv is written to
+    """
+    def __init__(self, root_directory_name, output_dir):
+        self.output_dir = output_dir
+        df = read_player_gws_text(root_directory_name)
+        self.fieldnames = [c for c in df.columns if c not in KEY_COLUMNS]
+        fixtures = pd.read_csv(os.path.join(root_directory_name, 'fixtures.csv'), usecols=['id', 'team_h', 'team_a'])
+        teams = pd.read_csv(os.path.join(root_directory_name, 'teams.csv'), usecols=['id', 'name'])
+        players = pd.read_csv(os.path.join(root_directory_name, 'players_raw.csv'), dtype=str,
+                              keep_default_na=False, encoding='utf-8',
+                              usecols=['id', 'element_type', 'first_name', 'second_name'])
+        pos_dict = {'1': "GK", '2': "DEF", '3': "MID", '4': "FWD"}
+        players.index = players['id'].astype(int)
+        player_ids = df['player_id'].astype(int)
+        df['name'] = player_ids.map(players['first_name'] + ' ' + players['second_name'])
+        df['position'] = player_ids.map(players['element_type'].map(pos_dict))
+        fixtures = fixtures.set_index('id')
+        fixture_ids = df['fixture'].astype(int)
+        team_ids = np.where(df['was_home'] == 'True',
+                            fixture_ids.map(fixtures['team_h']),
+                            fixture_ids.map(fixtures['team_a']))
+        df['team'] = pd.Series(team_ids, index=df.index).map(teams.set_index('id')['name'])
+        self.df = df
+        self.round_rows = df.groupby(df['round'].astype(int)).indices
+
+    def build(self, gws):
+        """ Write gwN.csv for every gameweek in gws
+        """
+        for gw in gws:
+            self.build_gw(gw)
+
+    def build_gw(self, gw):
+        xPoints = get_expected_points(gw, self.output_dir)
+        rows = self.df.iloc[self.round_rows.get(gw, [])]
+        xP = rows['player_id'].astype(int).map(xPoints).fillna(str(0.0))
+        fieldnames = ['name', 'position', 'team', 'xP'] + self.fieldnames
+        out_path = os.path.join(self.output_dir, "gw" + str(gw) + ".csv")
+        with open(out_path, 'w', encoding="utf-8") as outf:
+            writer = csv.writer(outf, lineterminator='\n')
+            writer.writerow(fieldnames)
+            writer.writerows(rows.assign(xP=xP)[fieldnames].values.tolist())
+        mirror_csv(out_path)
 
-def collect_all_gws(directory_name, output_dir):
-    for i in range(1,5):
-        collect_gw(i, directory_name, output_dir)
+def collect_all_gws(directory_name, output_dir, root_directory_name="data/2021-22", processes=None):
+    collect_gws(directory_name, output_dir, root_directory_name=root_directory_name, processes=processes)
 
 def merge_all_gws(num_gws, gw_directory):
+    for filename in (MERGED_GW_FILENAME, MERGED_GW_INDEX_FILENAME):
+        if os.path.exists(os.path.join(gw_directory, filename)):
+            os.remove(os.path.join(gw_directory, filename))
     for i in range(1, num_gws):
         merge_gw(i, gw_directory)
 
@@ -1,6 +1,5 @@
 from datetime import datetime
-import requests
-import json
+from getters import get_data
 
 
 def get_recent_gameweek_id():
@@ -8,8 +7,7 @@ def get_recent_gameweek_id():
     Get's the most recent gameweek's ID.
     """
 
-    data = requests.get('https://fantasy.premierleague.com/api/bootstrap-static/')
-    data = json.loads(data.content)
+    data = get_data()
 
     gameweeks = data['events']
     
@@ -1,35 +1,167 @@
 import requests
 import json
+import random
+import threading
 import time
+from cache import ResponseCache
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+
+BASE_URL = "https://fantasy.premierleague.com/api/"
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+REQUEST_TIMEOUT = 30
+
+session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+session.mount('https://', _adapter)
+session.mount('http://', _adapter)
+response_cache = None
+
+def enable_cache(directory='.http_cache', ttl=900, max_bytes=256 * 1024 * 1024):
+    """ Serve every getter through an on-disk conditional-request cache
+
+    Args:
+        directory (str): Folder the cache lives in
+        ttl (float): Seconds a cached response is used without asking the server
+        max_bytes (int): Upper bound on the size of the cache before old entries are evicted
+    """
+    global response_cache
+    response_cache = ResponseCache(directory, ttl, max_bytes)
+    return response_cache
+
+def disable_cache():
+    global response_cache
+    response_cache = None
+
+class HostRateLimiter:
+    """ Spaces out requests so that at most `rate` are started per second per host
+
+    Args:
+        rate (float): Maximum requests per second to a single host, None for no limit
+    """
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_slot = {}
+
+    def wait(self, url):
+        if not self.interval:
+            return
+        host = urlparse(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+def backoff_delay(attempt):
+    """ Exponential backoff with full jitter for the given (zero-based) retry attempt
+    """
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+def retry_after_delay(response):
+    """ Seconds the server asked us to wait in its Retry-After header, if any
+    """
+    try:
+        return min(BACKOFF_CAP, float(response.headers.get('Retry-After')))
+    except (TypeError, ValueError):
+        return None
+
+def get_response(url, rate_limiter=None, headers=None):
+    """ Fetch a url over the shared pooled session
+
+    Connection errors, 429s and 5xx responses are retried up to MAX_RETRIES times
+    with exponential backoff. 429s honour the server's Retry-After header. Any other
+    non-200 response is raised straight away, except a 304 to a conditional request.
+
+    Args:
+        url (str): Full url to fetch
+        rate_limiter (HostRateLimiter): Optional limiter shared between concurrent callers
+        headers (dict): Extra request headers
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        if rate_limiter is not None:
+            rate_limiter.wait(url)
+        try:
+            response = session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt == MAX_RETRIES:
+                raise
+            time.sleep(backoff_delay(attempt))
+            continue
+        if response.status_code == 200 or (response.status_code == 304 and headers):
+            return response
+        if response.status_code != 429 and response.status_code < 500:
+            raise Exception("Response was code " + str(response.status_code))
+        if attempt == MAX_RETRIES:
+            raise Exception("Response was code " + str(response.status_code) + " after " + str(MAX_RETRIES) + " retries")
+        delay = None
+        if response.status_code == 429:
+            delay = retry_after_delay(response)
+        time.sleep(delay if delay is not None else backoff_delay(attempt))
+
+def get_text(url, rate_limiter=None):
+    """ Fetch the body of a url, going through the response cache when it is enabled
+    """
+    cache = response_cache
+    if cache is None:
+        return get_response(url, rate_limiter).text
+    entry = cache.lookup(url)
+    if entry is not None and cache.is_fresh(entry):
+        text = cache.read(url)
+        if text is not None:
+            return text
+        # Evicted by another thread since the lookup, so there is nothing to revalidate
+        entry = None
+    response = get_response(url, rate_limiter, cache.conditional_headers(entry))
+    if response.status_code == 304:
+        text = cache.read(url)
+        if text is not None:
+            cache.refresh(url, entry, response.headers)
+            return text
+        response = get_response(url, rate_limiter)
+    cache.store(url, response.text, response.headers)
+    return response.text
+
+def get_json(url, rate_limiter=None):
+    """ Fetch a url and decode its json body
+    """
+    return json.loads(get_text(url, rate_limiter))
 
 def get_data():
     """ Retrieve the fpl player data from the hard-coded url
     """
-    response = requests.get("https://fantasy.premierleague.com/api/bootstrap-static/")
-    if response.status_code != 200:
-        raise Exception("Response was code " + str(response.status_code))
-    responseStr = response.text
-    data = json.loads(responseStr)
-    return data
-
-def get_individual_player_data(player_id):
+    return get_json(BASE_URL + "bootstrap-static/")
+
+def get_individual_player_data(player_id, rate_limiter=None):
     """ Retrieve the player-specific detailed data
 
     Args:
         player_id (int): ID of the player whose data is to be retrieved
+        rate_limiter (HostRateLimiter): Optional limiter shared between concurrent callers
     """
-    base_url = "https://fantasy.premierleague.com/api/element-summary/"
-    full_url = base_url + str(player_id) + "/"
-    response = ''
-    while response == '':
-        try:
-            response = requests.get(full_url)
-        except:
-            time.sleep(5)
-    if response.status_code != 200:
-        raise Exception("Response was code " + str(response.status_code))
-    data = json.loads(response.text)
-    return data
+    return get_json(BASE_URL + "element-summary/" + str(player_id) + "/", rate_limiter)
+
+def get_individual_players_data(player_ids, workers=8, rate_limit=None):
+    """ Retrieve the player-specific detailed data for many players concurrently
+
+    Args:
+        player_ids (iterable): IDs of the players whose data is to be retrieved
+        workers (int): Number of requests allowed in flight at once
+        rate_limit (float): Maximum requests per second to the API host, None for no limit
+
+    Returns:
+        list of (player_id, data) tuples in player-id order
+    """
+    ids = sorted(player_ids)
+    rate_limiter = HostRateLimiter(rate_limit)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(lambda i: get_individual_player_data(i, rate_limiter), ids)
+        return list(zip(ids, results))
 
 def get_entry_data(entry_id):
     """ Retrieve the summary/history data for a specific entry/team
@@ -37,18 +169,7 @@ def get_entry_data(entry_id):
     Args:
         entry_id (int) : ID of the team whose data is to be retrieved
     """
-    base_url = "https://fantasy.premierleague.com/api/entry/"
-    full_url = base_url + str(entry_id) + "/history/"
-    response = ''
-    while response == '':
-        try:
-            response = requests.get(full_url)
-        except:
-            time.sleep(5)
-    if response.status_code != 200:
-        raise Exception("Response was code " + str(response.status_code))
-    data = json.loads(response.text)
-    return data
+    return get_json(BASE_URL + "entry/" + str(entry_id) + "/history/")
 
 def get_entry_personal_data(entry_id):
     """ Retrieve the summary/history data for a specific entry/team
@@ -56,18 +177,7 @@ def get_entry_personal_data(entry_id):
     Args:
         entry_id (int) : ID of the team whose data is to be retrieved
     """
-    base_url = "https://fantasy.premierleague.com/api/entry/"
-    full_url = base_url + str(entry_id) + "/"
-    response = ''
-    while response == '':
-        try:
-            response = requests.get(full_url)
-        except:
-            time.sleep(5)
-    if response.status_code != 200:
-        raise Exception("Response was code " + str(response.status_code))
-    data = json.loads(response.text)
-    return data
+    return get_json(BASE_URL + "entry/" + str(entry_id) + "/")
 
 def get_entry_gws_data(entry_id,num_gws,start_gw=1):
     """ Retrieve the gw-by-gw data for a specific entry/team
@@ -75,20 +185,10 @@ def get_entry_gws_data(entry_id,num_gws,start_gw=1):
     Args:
         entry_id (int) : ID of the team whose data is to be retrieved
     """
-    base_url = "https://fantasy.premierleague.com/api/entry/"
+    base_url = BASE_URL + "entry/" + str(entry_id) + "/event/"
     gw_data = []
     for i in range(start_gw, num_gws+1):
-        full_url = base_url + str(entry_id) + "/event/" + str(i) + "/picks/"
-        response = ''
-        while response == '':
-            try:
-                response = requests.get(full_url)
-            except:
-                time.sleep(5)
-        if response.status_code != 200:
-            raise Exception("Response was code " + str(response.status_code))
-        data = json.loads(response.text)
-        gw_data += [data]
+        gw_data += [get_json(base_url + str(i) + "/picks/")]
     return gw_data
 
 def get_entry_transfers_data(entry_id):
@@ -97,33 +197,12 @@ def get_entry_transfers_data(entry_id):
     Args:
         entry_id (int) : ID of the team whose data is to be retrieved
     """
-    base_url = "https://fantasy.premierleague.com/api/entry/"
-    full_url = base_url + str(entry_id) + "/transfers/"
-    response = ''
-    while response == '':
-        try:
-            response = requests.get(full_url)
-        except:
-            time.sleep(5)
-    if response.status_code != 200:
-        raise Exception("Response was code " + str(response.status_code))
-    data = json.loads(response.text)
-    return data
+    return get_json(BASE_URL + "entry/" + str(entry_id) + "/transfers/")
 
 def get_fixtures_data():
     """ Retrieve the fixtures data for the season
     """
-    url = "https://fantasy.premierleague.com/api/fixtures/"
-    response = ''
-    while response == '':
-        try:
-            response = requests.get(url)
-        except:
-            time.sleep(5)
-    if response.status_code != 200:
-        raise Exception("Response was code " + str(response.status_code))
-    data = json.loads(response.text)
-    return data
+    return get_json(BASE_URL + "fixtures/")
 
 def main():
     data = get_data()
@@ -1,23 +1,79 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pandas.api.types import union_categoricals
 from mergers import *
+from storage import read_table
 
-def merge_data():
-    """ Merge all the data and export to a new file
+try:
+    import resource
+except ImportError:
+    resource = None
+
+SEASONS = ['2016-17', '2017-18', '2018-19', '2019-20', '2020-21', '2021-22']
+SEASON_ENCODINGS = ['latin-1', 'latin-1', 'latin-1', 'utf-8', 'utf-8', 'utf-8']
+MERGED_COLUMNS = ['season','name', 'position', 'team', 'assists','bonus','bps','clean_sheets','creativity','element','fixture','goals_conceded','goals_scored','ict_index','influence','kickoff_time','minutes','opponent_team','own_goals','penalties_missed','penalties_saved','red_cards','round','saves','selected','team_a_score','team_h_score','threat','total_points','transfers_balance','transfers_in','transfers_out','value','was_home','yellow_cards','GW']
+# Text columns repeated on every row are held as categoricals. Numeric columns are left to
+# inference since unplayed fixtures leave gaps that an integer dtype can't hold.
+CATEGORY_COLUMNS = ['season', 'name', 'position', 'team']
+SEASON_DTYPES = {'name': 'category', 'position': 'category', 'team': 'category', 'kickoff_time': str}
+
+def peak_memory_mb():
+    """ Peak resident memory of this process in MB, or None where the platform doesn't report it
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def load_season(season, encoding):
+    """ One season's merged_gw.csv, cut down to the merged columns
+    """
+    data = read_table(import_merged_gw(season=season), usecols=lambda c: c in MERGED_COLUMNS,
+                      dtype=SEASON_DTYPES, encoding=encoding)
+    data['season'] = pd.Categorical([season] * len(data))
+    return data
+
+def concat_seasons(frames):
+    """ Concatenate season frames once, giving each categorical column the union of every
+    season's categories first so the result stays categorical
+    """
+    frames = [frame.astype({c: 'category' for c in CATEGORY_COLUMNS if c in frame.columns}) for frame in frames]
+    for col in CATEGORY_COLUMNS:
+        present = [frame[col] for frame in frames if col in frame.columns]
+        if len(present) == 0:
+            continue
+        categories = union_categoricals(present, ignore_order=True).categories
+        frames = [frame.assign(**{col: frame[col].cat.set_categories(categories)})
+                  if col in frame.columns else frame.assign(**{col: pd.Categorical([None] * len(frame), categories=categories)})
+                  for frame in frames]
+    return pd.concat(frames, ignore_index=True, sort=False)
+
+def load_seasons(seasons=SEASONS, encodings=SEASON_ENCODINGS, workers=None):
+    """ Load every season's merged_gw.csv on a thread pool and concatenate them once
+
+    Args:
+        seasons (list): Season folders under data/
+        encodings (list): Encoding of each season's merged_gw.csv
+        workers (int): Seasons read at once, one per season if None
     """
-    season_latin = ['2016-17', '2017-18', '2018-19', '2019-20', '2020-21', '2021-22'] 
-    encoding_latin = ['latin-1', 'latin-1', 'latin-1', 'utf-8', 'utf-8', 'utf-8']
+    with ThreadPoolExecutor(max_workers=workers or len(seasons)) as executor:
+        frames = list(executor.map(load_season, seasons, encodings))
+    return concat_seasons(frames)
 
-    df = pd.DataFrame()
-    for i,j in zip(season_latin, encoding_latin):
-        data = pd.read_csv(import_merged_gw(season=f'{i}'), encoding=f'{j}')
-        data['season'] = i
-        df = df.append(data, ignore_index=True, sort=False)
+def merge_data(workers=None):
+    """ Merge all the data and export to a new file
+    """
+    df = load_seasons(workers=workers)
 
-    df = df[['season','name', 'position', 'team', 'assists','bonus','bps','clean_sheets','creativity','element','fixture','goals_conceded','goals_scored','ict_index','influence','kickoff_time','minutes','opponent_team','own_goals','penalties_missed','penalties_saved','red_cards','round','saves','selected','team_a_score','team_h_score','threat','total_points','transfers_balance','transfers_in','transfers_out','value','was_home','yellow_cards','GW']]
+    df = df[MERGED_COLUMNS]
 
     df = clean_players_name_string(df, col='name')
     df = filter_players_exist_latest(df, col='position')
     df = get_opponent_team_name(df)
 
+    #the exported file keeps the column names and row numbering of the old merge-based lookup
+    df = df.rename(columns={'season': 'season_x', 'team': 'team_x'}).reset_index(drop=True)
     df = df[['season_x', 'name', 'position', 'team_x', 'assists', 'bonus', 'bps',
        'clean_sheets', 'creativity', 'element', 'fixture', 'goals_conceded',
        'goals_scored', 'ict_index', 'influence', 'kickoff_time', 'minutes',
@@ -28,9 +84,12 @@ def merge_data():
        'GW']]
     
     export_cleaned_data(df)
+    peak = peak_memory_mb()
+    if peak is not None:
+        print("Peak memory: %.1f MB" % peak)
 
 def main():
     merge_data()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
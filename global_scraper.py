@@ -1,13 +1,52 @@
 from parsers import *
 from cleaners import *
 from getters import *
-from collector import collect_gw, merge_gw
+from collector import GameweekBuilder, merge_gw
 from understat import parse_epl_data
+from players_gw import write_player_gws
 import csv
+import sys
 
-def parse_data():
+# team_fixtures_started catches players whose summary doesn't move when their team plays,
+# e.g. an unused substitute, who still gets a zero row for the fixture in their history
+SNAPSHOT_FIELDS = ['event_points', 'transfers_in_event', 'now_cost', 'total_points', 'team', 'team_fixtures_started']
+
+def team_fixtures_started(fixtures_data):
+    """ Number of fixtures each team id has kicked off in so far
+    """
+    started = {}
+    for fixture in fixtures_data:
+        if fixture['started']:
+            for team in (fixture['team_h'], fixture['team_a']):
+                started[team] = started.get(team, 0) + 1
+    return started
+
+def changed_players(list_of_players, snapshot):
+    """ Ids of the players whose snapshot fields differ from the last run, or who are new
+
+    Args:
+        list_of_players (list): bootstrap-static elements
+        snapshot (dict): Player id to the fields recorded on the last run
+    """
+    changed = []
+    for player in list_of_players:
+        previous = snapshot.get(player['id'])
+        if previous is None or any(str(player[f]) != previous.get(f) for f in SNAPSHOT_FIELDS):
+            changed += [player['id']]
+    return changed
+
+def parse_data(workers=8, rate_limit=20, cache_dir='.http_cache', incremental=False):
     """ Parse and store all the data
+
+    Args:
+        workers (int): Number of player-specific requests allowed in flight at once
+        rate_limit (float): Maximum player-specific requests per second, None for no limit
+        cache_dir (str): Folder for the conditional-request response cache, None to disable it
+        incremental (bool): Only fetch players whose summary changed since the last run
+            and append their new rounds instead of rewriting every player's files
     """
+    if cache_dir:
+        enable_cache(cache_dir)
     season = '2021-22'
     base_filename = 'data/' + season + '/'
     print("Getting data")
@@ -25,23 +64,36 @@ def parse_data():
     for event in events:
         if event["is_current"] == True:
             gw_num = event["id"]
-    print("Cleaning summary data")
-    clean_players(base_filename + 'players_raw.csv', base_filename)
+    print("Cleaning summary data and extracting player ids")
+    player_ids = clean_and_id_players(base_filename + 'players_raw.csv', base_filename)
     print("Getting fixtures data")
-    fixtures(base_filename)
+    started = team_fixtures_started(fixtures(base_filename))
+    for e in data["elements"]:
+        e['team_fixtures_started'] = started.get(e['team'], 0)
     print("Getting teams data")
     parse_team_data(data["teams"], base_filename)
-    print("Extracting player ids")
-    id_players(base_filename + 'players_raw.csv', base_filename)
-    player_ids = get_player_ids(base_filename)
     num_players = len(data["elements"])
     player_base_filename = base_filename + 'players/'
     gw_base_filename = base_filename + 'gws/'
-    print("Extracting player specific data")
-    for i,name in player_ids.items():
-        player_data = get_individual_player_data(i)
-        parse_player_history(player_data["history_past"], player_base_filename, name, i)
-        parse_player_gw_history(player_data["history"], player_base_filename, name, i)
+    if incremental:
+        fetch_ids = changed_players(data["elements"], get_player_snapshot(base_filename))
+    else:
+        fetch_ids = player_ids.keys()
+    print("Extracting player specific data for " + str(len(fetch_ids)) + " players")
+    player_gws = {}
+    for i,player_data in get_individual_players_data(fetch_ids, workers, rate_limit):
+        name = player_ids[i]
+        player_gws[i] = (name, player_data["history"])
+        history_filename = player_base_filename + name + '_' + str(i) + '/history.csv'
+        if not incremental or not os.path.exists(history_filename):
+            parse_player_history(player_data["history_past"], player_base_filename, name, i)
+        if incremental:
+            append_player_gw_history(player_data["history"], player_base_filename, name, i)
+        else:
+            parse_player_gw_history(player_data["history"], player_base_filename, name, i)
+    print("Writing season player gameweek table")
+    write_player_gws(player_gws, base_filename, keep_existing=incremental)
+    parse_player_snapshot(data["elements"], base_filename, SNAPSHOT_FIELDS)
     if gw_num > 0:
         print("Writing expected points")
         with open(os.path.join(gw_base_filename, 'xP' + str(gw_num) + '.csv'), 'w+') as outf:
@@ -50,7 +102,7 @@ def parse_data():
             for xp in xPoints:
                 w.writerow(xp)
         print("Collecting gw scores")
-        collect_gw(gw_num, player_base_filename, gw_base_filename, base_filename) 
+        GameweekBuilder(base_filename, gw_base_filename).build_gw(gw_num)
         print("Merging gw scores")
         merge_gw(gw_num, gw_base_filename)
     understat_filename = base_filename + 'understat'
@@ -59,9 +111,10 @@ def parse_data():
 def fixtures(base_filename):
     data = get_fixtures_data()
     parse_fixtures(data, base_filename)
+    return data
 
 def main():
-    parse_data()
+    parse_data(incremental=len(sys.argv) > 1 and sys.argv[1] == 'incremental')
 
 if __name__ == "__main__":
     main()
@@ -3,10 +3,16 @@ import webbrowser
 import dash_core_components as dcc
 import dash_html_components as html
 import base64
+import json
+import os
 
+import pandas as pd
+from functools import lru_cache
 from threading import Timer
 from ht_analysis.datautils import DataUtils
+from players_gw import RowIndex
 from plotly import graph_objects as go
+from plotly.utils import PlotlyJSONEncoder
 from warnings import filterwarnings
 filterwarnings('ignore')
 
@@ -21,9 +27,15 @@ app.title = "FPL Algo"
 app_color = {"graph_bg": "#ffd5cc", "graph_line": "#007ACE"}
 
 du = DataUtils()
-res = du.get_gameweek_superset()
+res = du.get_gameweek_superset_cached()
+player_index = RowIndex(res, 'player_name')
+round_index = RowIndex(res, 'round', sort=True)
 axes_choice = list(sorted(set(res.columns)))
 pl_name = 'Kevin De Bruyne'
+# Above this many points the 2D scatter is drawn with WebGL
+WEBGL_THRESHOLD = 2000
+# Most points the downsampled render mode sends to the browser
+MAX_POINTS = 5000
 
 image_filename = 'Resources/Small Alt Lion Angry Red Crown Black Outline.jpg'
 encoded_image = base64.b64encode(open(image_filename, 'rb').read())
@@ -85,10 +97,20 @@ app.layout = html.Div([
         html.Div([
             dcc.Dropdown(
                 id='dropdown-gw',
-                options=[{'label': i, 'value': i} for i in list(sorted(set(res['round'])))],
-                value = max(res['round'])
+                options=[{'label': 'All', 'value': 'all'}] + [{'label': i, 'value': i} for i in round_index.keys()],
+                value = max(round_index.keys())
             )
         ], style={'width': '8%', 'float': 'centre', 'display': 'inline-block'}),
+
+        html.Div([
+            dcc.Dropdown(
+                id='dropdown-render',
+                options=[{'label': 'Auto', 'value': 'auto'},
+                         {'label': 'Binned', 'value': 'binned'}],
+                value = 'auto',
+                clearable=False
+            )
+        ], style={'width': '9%', 'float': 'centre', 'display': 'inline-block'}),
         
         html.Div([
             dcc.Dropdown(
@@ -98,7 +120,7 @@ app.layout = html.Div([
                 placeholder = 'Team(s)',
                 multi=True
             )
-        ], style={'width': '36%', 'float': 'centre', 'display': 'inline-block'}),
+        ], style={'width': '27%', 'float': 'centre', 'display': 'inline-block'}),
     
     ], style={
         'borderBottom': 'thin lightgrey solid',
@@ -111,7 +133,8 @@ app.layout = html.Div([
             id='main-scatter',
             clear_on_unhover=False,
             hoverData={'points': [{'customdata': pl_name}]}
-        )
+        ),
+        html.Div(id='main-scatter-payload', style={'fontSize': 'small', 'color': 'grey'})
     ], style={'width': '60%', 'height': '100%', 'display': 'inline-block',
               'padding': '0 20'}),
     
@@ -129,23 +152,56 @@ app.layout = html.Div([
     # html.Div(id='sub-df', style={'display': 'none'}),
 ])
 
+def bin_downsample(df, cols, max_points):
+    '''Keep the first row in each occupied cell of a grid laid over the numeric
+    axes, so dense clusters thin out while outliers survive. Falls back to a
+    fixed random sample when no axis is numeric'''
+    if len(df) <= max_points:
+        return df
+    numeric = [c for c in cols if pd.api.types.is_numeric_dtype(df[c])]
+    if not numeric:
+        return df.sample(max_points, random_state=0).sort_index()
+    bins = max(1, int(max_points ** (1 / len(numeric))))
+    cells = pd.DataFrame({c: pd.cut(df[c], bins, labels=False) for c in numeric}, index=df.index)
+    return df.loc[~cells.duplicated().values]
+
+def figure_payload_size(figure):
+    '''Bytes of json the figure costs to send to the browser'''
+    return len(json.dumps(figure, cls=PlotlyJSONEncoder))
+
 @app.callback(
-    dash.dependencies.Output('main-scatter', 'figure'),
+    [dash.dependencies.Output('main-scatter', 'figure'),
+     dash.dependencies.Output('main-scatter-payload', 'children')],
     [dash.dependencies.Input('dropdown-axis1', 'value'),
       dash.dependencies.Input('dropdown-axis2', 'value'),
       dash.dependencies.Input('dropdown-axis3', 'value'),
       dash.dependencies.Input('dropdown-gw', 'value'),
       dash.dependencies.Input('dropdown-team', 'value'),
       dash.dependencies.Input('dropdown-position', 'value'),
+      dash.dependencies.Input('dropdown-render', 'value'),
       ])
-def update_main_scatter_graph(axis1, axis2, axis3, gw, team, position):
+def update_main_scatter_graph(axis1, axis2, axis3, gw, team, position, render_mode):
+    key = view_key(axis1, axis2, axis3, gw, team, position, render_mode)
+    if key in figure_cache:
+        return figure_cache[key]
+    return render_main_scatter(axis1, axis2, axis3, gw, team, position, render_mode)
+
+def render_main_scatter(axis1, axis2, axis3, gw, team, position, render_mode):
+    figure, num_points = main_scatter_figure(axis1, axis2, axis3, gw, team, position, render_mode)
+    payload = figure_payload_size(figure)
+    return figure, f"{num_points} points, {payload / 1024:.0f} KB"
+
+def main_scatter_figure(axis1, axis2, axis3, gw, team, position, render_mode='auto'):
     cols_to_pull = ['player_name','team', 'position_pl', axis1, axis2]
     if axis3: cols_to_pull.append(axis3)
-    sub_df = res[cols_to_pull].loc[res['round']==gw]
+    sub_df = res[cols_to_pull] if gw == 'all' else round_index.get(gw)[cols_to_pull]
     if team:
         sub_df = sub_df.loc[sub_df['team'].isin(team)]
     if position:
         sub_df = sub_df.loc[sub_df['position_pl'] == position]
+    if render_mode == 'binned':
+        sub_df = bin_downsample(sub_df, [c for c in (axis1, axis2, axis3) if c], MAX_POINTS)
+    scatter = go.Scattergl if len(sub_df) > WEBGL_THRESHOLD else go.Scatter
     traces = []
     titletext = f"{axis1} vs {axis2} - GW {gw}"
     if axis3:
@@ -164,7 +220,7 @@ def update_main_scatter_graph(axis1, axis2, axis3, gw, team, position):
                                     customdata=sub_df['player_name']),
                       )
     else:
-        traces.append(go.Scatter(x=sub_df[axis1],
+        traces.append(scatter(x=sub_df[axis1],
                                     y=sub_df[axis2],
                                     text=sub_df['player_name'], 
                                     mode='markers',
@@ -176,7 +232,7 @@ def update_main_scatter_graph(axis1, axis2, axis3, gw, team, position):
                                     },
                                     customdata=sub_df['player_name']),
                       )
-    return {
+    figure = {
         'data': traces,
         'layout': dict(
             xaxis={'title': axis1,'type': 'linear'},
@@ -197,14 +253,10 @@ def update_main_scatter_graph(axis1, axis2, axis3, gw, team, position):
                 'yanchor': 'top'}
         )
     }
+    return figure, len(sub_df)
 
-@app.callback(
-    dash.dependencies.Output('timeseries-1', 'figure'),
-    [dash.dependencies.Input('main-scatter', 'hoverData')])
-def update_top_timeseries(hdata):
+def top_timeseries_figure(pl_name, pl_df):
     '''Total points & mins played time series'''
-    pl_name = hdata['points'][0]['customdata']
-    pl_df = res.loc[res['player_name'] == pl_name].reset_index(drop=True)
     title = pl_name
     traces = []
     traces.append(dict(
@@ -251,13 +303,8 @@ def update_top_timeseries(hdata):
                 'orientation':'h'},}
     }
 
-@app.callback(
-    dash.dependencies.Output('timeseries-2', 'figure'),
-    [dash.dependencies.Input('main-scatter', 'hoverData')])
-def update_second_timeseries(hdata):
+def second_timeseries_figure(pl_name, pl_df):
     '''Goals scored / assists time series'''
-    pl_name = hdata['points'][0]['customdata']
-    pl_df = res.loc[res['player_name'] == pl_name].reset_index(drop=True)
     traces = []
     traces.append(dict(
         x = pl_df['round'],
@@ -315,13 +362,8 @@ def update_second_timeseries(hdata):
                 'orientation':'h'},}
     }
 
-@app.callback(
-    dash.dependencies.Output('timeseries-3', 'figure'),
-    [dash.dependencies.Input('main-scatter', 'hoverData')])
-def update_third_timeseries(hdata):
+def third_timeseries_figure(pl_name, pl_df):
     '''Transfers in / out timeseries'''
-    pl_name = hdata['points'][0]['customdata']
-    pl_df = res.loc[res['player_name'] == pl_name].reset_index(drop=True)
     traces = []
     traces.append(dict(
         x = pl_df['round'],
@@ -365,6 +407,61 @@ def update_third_timeseries(hdata):
                 'orientation':'h'},}
     }
 
+@lru_cache(maxsize=256)
+def player_timeseries_figures(pl_name):
+    '''All three timeseries figures for a player from a single slice of the superset.
+    Memoized so re-hovering a recent player costs nothing'''
+    pl_df = player_index.get(pl_name).reset_index(drop=True)
+    return (top_timeseries_figure(pl_name, pl_df),
+            second_timeseries_figure(pl_name, pl_df),
+            third_timeseries_figure(pl_name, pl_df))
+
+@app.callback(
+    [dash.dependencies.Output('timeseries-1', 'figure'),
+     dash.dependencies.Output('timeseries-2', 'figure'),
+     dash.dependencies.Output('timeseries-3', 'figure')],
+    [dash.dependencies.Input('main-scatter', 'hoverData')])
+def update_timeseries(hdata):
+    pl_name = hdata['points'][0]['customdata']
+    return player_timeseries_figures(pl_name)
+
+def view_key(axis1, axis2, axis3, gw, team, position, render_mode):
+    return json.dumps([axis1, axis2, axis3 or '', str(gw), sorted(team) if team else [],
+                       position or '', render_mode])
+
+def default_views():
+    '''The landing view plus the views people switch to most: every gameweek and
+    every position on the default axes'''
+    latest_gw = max(round_index.keys())
+    views = [('value', 'total_points', '', latest_gw, '', '', 'auto')]
+    views += [('value', 'total_points', '', gw, '', '', 'auto') for gw in round_index.keys() if gw != latest_gw]
+    views += [('value', 'total_points', '', latest_gw, '', pos, 'auto') for pos in sorted(set(res['position_pl']))]
+    views += [('value', 'total_points', '', 'all', '', '', 'auto')]
+    return views
+
+def warm_figure_cache(cache_path):
+    '''Load the pre-rendered default views, rendering and saving them again when the
+    superset they were drawn from has changed'''
+    superset_key = getattr(du, 'superset_key', None) or du.get_superset_key()
+    if os.path.exists(cache_path):
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached['superset_key'] == superset_key:
+            return {k: tuple(v) for k, v in cached['figures'].items()}
+    figures = {}
+    for view in default_views():
+        figure, caption = render_main_scatter(*view)
+        # Round trip through json so cached entries are plain data, cheap to send again
+        figures[view_key(*view)] = (json.loads(json.dumps(figure, cls=PlotlyJSONEncoder)), caption)
+    tmp_path = cache_path + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'superset_key': superset_key, 'figures': figures}, f)
+    os.replace(tmp_path, cache_path)
+    return figures
+
+figure_cache = warm_figure_cache(os.path.join(du.season_path, 'figure_cache.json'))
+player_timeseries_figures(pl_name)
+
 if __name__ == '__main__':
     port = '8050'
     # Timer(2, open_browser(port)).start();
@@ -1,6 +1,11 @@
+import hashlib
+import json
 import os
 
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from players_gw import TABLE_FILENAME
+from storage import fresh_columnar_path, read_table
 
 
 class DataUtils():
@@ -13,43 +18,54 @@ class DataUtils():
         subfolder = 'gws'
         sub_path = os.path.join(self.season_path, subfolder)
         fpath = os.path.join(sub_path, 'merged_gw.csv')
-        return pd.read_csv(fpath)
+        return read_table(fpath)
+
+    @staticmethod
+    def split_player_key(key):
+        '''"First_Last_123" -> ("First Last", 123), for folder and file names'''
+        pname, _, p_id = key.rpartition('_')
+        return pname.replace('_', ' '), int(p_id)
+
+    @staticmethod
+    def read_player_file(fpath, pname, p_id):
+        df = pd.read_csv(fpath)
+        df.insert(0, 'player_name', pname)
+        df.insert(0, 'player_id', p_id)
+        return df
+
+    def read_player_files(self, jobs, workers=8):
+        '''Read (path, player name, player id) jobs on a thread pool and concat once'''
+        if not jobs:
+            return pd.DataFrame()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            frames = list(pool.map(lambda job: self.read_player_file(*job), jobs))
+        return pd.concat(frames)
 
-    def get_player_agg_data(self):
-        '''Source is FPL data, weekly gameweek player data'''
+    def get_player_agg_data(self, workers=8):
+        '''Source is FPL data, weekly gameweek player data. Read from the season's
+        players_gw.csv table when the scraper has written one, else from the players tree'''
+        table_path = os.path.join(self.season_path, TABLE_FILENAME)
+        if os.path.exists(table_path) or fresh_columnar_path(table_path) is not None:
+            return read_table(table_path)
         subfolder = 'players'
         filename = 'gw.csv'
         fpath = os.path.join(self.season_path, subfolder)
-        df_res = pd.DataFrame()
-        for dirpath, dirnames, filenames in os.walk(fpath):
-            if filename in filenames:
-                df = pd.read_csv(os.path.join(dirpath, filename))
-                filename_split = dirpath.split('\\')[-1].split('_')
-                pname = ' '.join(filename_split[0:-1])
-                p_id = int(filename_split[-1])
-                df.insert(0, 'player_name', pname)
-                df.insert(0, 'player_id', p_id)
-                df_res = pd.concat([df_res, df])
-        return df_res
-    
-    def get_player_understat_data(self):
+        jobs = []
+        for entry in sorted(os.scandir(fpath), key=lambda e: e.name):
+            gw_path = os.path.join(entry.path, filename)
+            if entry.is_dir() and os.path.exists(gw_path):
+                jobs.append((gw_path, *self.split_player_key(entry.name)))
+        return self.read_player_files(jobs, workers)
+
+    def get_player_understat_data(self, workers=8):
         subfolder = 'understat'
-        filename = 'gw.csv'
         fpath = os.path.join(self.season_path, subfolder)
-        df_res = pd.DataFrame()
-        for dirpath, dirnames, filenames in os.walk(fpath):
-            for filename in filenames:
-                if 'understat_' in filename:
-                    continue
-                temp_path = os.path.join(dirpath, filename)
-                df = pd.read_csv(temp_path)
-                filename_split = temp_path.split('\\')[-1].split('_')
-                pname = ' '.join(filename_split[0:-1])
-                p_id = int(filename_split[-1][:-4]) # Strip out .csv at the end
-                df.insert(0, 'player_name', pname)
-                df.insert(0, 'player_id', p_id)
-                df_res = pd.concat([df_res, df])
-        return df_res
+        jobs = []
+        for filename in sorted(os.listdir(fpath)):
+            if 'understat_' in filename or not filename.endswith('.csv'):
+                continue
+            jobs.append((os.path.join(fpath, filename), *self.split_player_key(filename[:-4]))) # Strip out .csv at the end
+        return self.read_player_files(jobs, workers)
     
     def get_understat_summary_data(self):
         fpath = os.path.join(self.season_path, 'understat', 'understat_player.csv')
@@ -84,14 +100,16 @@ class DataUtils():
         df_gw = self.get_gw_data()
         df_us = self.get_player_understat_data() # To be joined...
         # Process fields
-        df_us = df_us.replace({'player_id': d_id_link})
-        df_gw['kickoff_date'] = pd.to_datetime(df_gw['kickoff_time'])
-        df_us['date'] = pd.to_datetime(df_us['date'])
-        df_gw['kickoff_date'] = df_gw['kickoff_date'].dt.date
-        df_us['date'] = df_us['date'].dt.date
+        us_ids = df_us['player_id']
+        df_us['player_id'] = us_ids.map(d_id_link).where(us_ids.isin(d_id_link.keys()), us_ids)
+        kickoff = pd.to_datetime(df_gw['kickoff_time'])
+        df_gw['kickoff_date'] = kickoff.dt.date
+        df_gw['_kickoff'] = kickoff
+        df_us['date'] = pd.to_datetime(df_us['date']).dt.date
         id_dict = self.get_player_id_list()
-        df_gw['player_id'] = df_gw['name']
-        df_gw = df_gw.replace({'player_id': id_dict})
+        # Names missing from id_dict are kept as is, so the column stays object like the names
+        names = df_gw['name']
+        df_gw['player_id'] = names.map(id_dict).where(names.isin(id_dict.keys()), names).astype(object)
         # Join tables
         temp_df = pd.merge(df_us, 
                              df_gw, 
@@ -105,18 +123,62 @@ class DataUtils():
         #                      left_on = ['player_name_pl','round'], 
         #                      right_on = ['name', 'round'],
         #                      suffixes = ("","_gw"))
-        temp_df['team'] = temp_df.apply(
-            lambda x: x['h_team'] if x['was_home'] else x['a_team'],
-            axis=1)
-        temp_df['opposition_team'] = temp_df.apply(
-            lambda x: x['a_team'] if x['was_home'] else x['h_team'],
-            axis=1)
+        was_home = temp_df['was_home'].astype(bool)
+        temp_df['team'] = temp_df['h_team'].where(was_home, temp_df['a_team'])
+        temp_df['opposition_team'] = temp_df['a_team'].where(was_home, temp_df['h_team'])
         temp_df['value'] = temp_df['value'] / 10
-        temp_df['kickoff_time'] = temp_df.apply(
-            lambda x: pd.to_datetime(x['kickoff_time']).time(),
-            axis=1)
+        temp_df['kickoff_time'] = temp_df.pop('_kickoff').dt.time
         return temp_df.dropna().reset_index(drop=True)
 
+    def get_superset_sources(self):
+        '''Every file get_gameweek_superset reads'''
+        gw_path = os.path.join(self.season_path, 'gws', 'merged_gw.csv')
+        paths = [gw_path,
+                 fresh_columnar_path(gw_path),
+                 os.path.join(self.season_path, 'id_dict.csv'),
+                 os.path.join(self.season_path, 'player_idlist.csv')]
+        understat_path = os.path.join(self.season_path, 'understat')
+        paths += [os.path.join(understat_path, f) for f in os.listdir(understat_path)]
+        return sorted(p for p in paths if p and os.path.exists(p))
+
+    def get_superset_key(self):
+        '''Hash of the superset source files' names, mtimes and sizes'''
+        h = hashlib.sha1()
+        for path in self.get_superset_sources():
+            st = os.stat(path)
+            h.update(f'{os.path.relpath(path, self.season_path)}|{st.st_mtime_ns}|{st.st_size}\n'.encode('utf-8'))
+        return h.hexdigest()
+
+    def get_gameweek_superset_cached(self):
+        '''get_gameweek_superset, served from a memory-mapped feather file until a source
+        file changes. Needs pyarrow; without it the superset is rebuilt every call'''
+        try:
+            import pyarrow as pa
+            from pyarrow import feather
+        except ImportError:
+            return self.get_gameweek_superset()
+        self.superset_key = self.get_superset_key()
+        data_path = os.path.join(self.season_path, 'superset_cache.feather')
+        meta_path = os.path.join(self.season_path, 'superset_cache.json')
+        meta = {}
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        if meta.get('key') == self.superset_key and os.path.exists(data_path):
+            df = feather.read_table(data_path, memory_map=True).to_pandas()
+            # Arrow has no mixed object columns, so put back the dtypes it narrowed
+            for col in meta['object_columns']:
+                df[col] = df[col].astype(object)
+            return df
+        df = self.get_gameweek_superset()
+        feather.write_feather(pa.Table.from_pandas(df, preserve_index=False), data_path,
+                              compression='uncompressed')
+        meta = {'key': self.superset_key,
+                'object_columns': [c for c in df.columns if df[c].dtype == object]}
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        return df
+
 if __name__ == '__main__':
     dh = DataUtils()
     # res2 = dh.get_player_id_list()
@@ -1,8 +1,8 @@
-from numpy.lib.index_tricks import _diag_indices_from
 import pandas as pd 
 import numpy as np
 from os.path import dirname, join
 import os
+from storage import write_table
 
 def import_merged_gw(season='2020-21'):
     """ Function to call merged_gw.csv file in every data/season folder
@@ -15,19 +15,29 @@ def import_merged_gw(season='2020-21'):
     season_path = join(dirname(dirname("__file__")), path, 'data', season, 'gws', filename)
     return season_path
 
+def normalize_player_name(name):
+    """ A player name with underscores as spaces, digits removed and outer whitespace trimmed
+    """
+    name = name.replace('_', ' ')
+    name = ''.join(ch for ch in name if not ch.isdecimal())
+    return name.strip()
+
 def clean_players_name_string(df, col='name'):
     """ Clean the imported file 'name' column because it has different patterns between seasons
 
+    Each distinct name is normalized once and the result mapped back onto the rows
+    through the categorical codes, leaving the column categorical.
+
     Args:
         df: merged df for all the seasons that have been imported
         col: name of the column for cleanup
     """
-    #replace _ with space in name column
-    df[col] = df[col].str.replace('_', ' ')
-    #remove number in name column
-    df[col] = df[col].str.replace('\d+', '')
-    #trim name column
-    df[col] = df[col].str.strip()
+    names = df[col].astype('category')
+    cleaned = names.cat.categories.map(normalize_player_name)
+    #names that only differed by underscores or numbers share a category after cleaning
+    cleaned_codes, categories = pd.factorize(cleaned, sort=True)
+    codes = np.where(names.cat.codes >= 0, cleaned_codes[names.cat.codes], -1)
+    df[col] = pd.Categorical.from_codes(codes, categories=categories)
     return df
 
 def filter_players_exist_latest(df, col='position'):
@@ -35,28 +45,27 @@ def filter_players_exist_latest(df, col='position'):
         Null meaning that player doesnt exist in latest season hence can exclude.
     """
 
-    df[col] = df.groupby('name')[col].apply(lambda x: x.ffill().bfill())
+    names = df['name']
+    filled = df[col].groupby(names, observed=True, sort=False).ffill()
+    df[col] = filled.groupby(names, observed=True, sort=False).bfill()
     df = df[df[col].notnull()]
     return df
 
 def get_opponent_team_name(df):
-    """ Find team name from master_team_list file and match with the merged df 
+    """ Find team name from master_team_list file and add it to the merged df as opp_team_name
+
+    The team list is indexed by (season, team id) and the opponents looked up in that
+    index directly, so df keeps its own columns and rows without a merge.
     """
 
     path = os.getcwd()
     filename = 'master_team_list.csv'
     team_path = join(dirname(dirname("__file__")), path, 'data', filename)
     df_team = pd.read_csv(team_path)
+    team_names = df_team.set_index(['season', 'team'])['team_name']
 
-    #create id column for both df_team and df
-    df['id'] = df['season'].astype(str) + '_' + df['opponent_team'].astype(str)
-    df_team['id'] = df_team['season'].astype(str) + '_' + df_team['team'].astype(str)
-
-    #merge two dfs
-    df = pd.merge(df, df_team, on = 'id', how = 'left')
-
-    #rename column
-    df = df.rename(columns={"team_name": "opp_team_name"})
+    opponents = pd.MultiIndex.from_arrays([df['season'].astype(str), df['opponent_team']])
+    df['opp_team_name'] = team_names.reindex(opponents).to_numpy()
     return df
 
 def export_cleaned_data(df):
@@ -69,5 +78,5 @@ def export_cleaned_data(df):
     path = os.getcwd()
     filename = 'cleaned_merged_seasons.csv'
     filepath = join(dirname(dirname("__file__")), path, 'data', filename)
-    df.to_csv(filepath, encoding = 'utf-8')
+    write_table(df, filepath, index=True, encoding = 'utf-8')
     return df
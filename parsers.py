@@ -2,6 +2,7 @@ import csv
 import os
 from utility import uprint
 import pandas as pd
+from storage import mirror_csv
 
 def extract_stat_names(dict_of_stats):
     """ Extracts all the names of the statistics
@@ -25,43 +26,87 @@ def parse_top_players(data, base_filename):
         row['player_id'] = player_id
         row['points'] = points
         rows += [row]
-    f = open(os.path.join(base_filename, 'best_players.csv'), 'w+', newline='')
-    w = csv.DictWriter(f, ['gw', 'player_id', 'points'])
-    w.writeheader()
-    for row in rows:
-        w.writerow(row)
+    with open(os.path.join(base_filename, 'best_players.csv'), 'w+', newline='') as f:
+        w = csv.DictWriter(f, ['gw', 'player_id', 'points'])
+        w.writeheader()
+        for row in rows:
+            w.writerow(row)
 
 def parse_players(list_of_players, base_filename):
-    stat_names = extract_stat_names(list_of_players[0])
     filename = base_filename + 'players_raw.csv'
     os.makedirs(os.path.dirname(filename), exist_ok=True)
-    f = open(filename, 'w+', encoding='utf8', newline='')
-    w = csv.DictWriter(f, sorted(stat_names))
-    w.writeheader()
-    for player in list_of_players:
-            w.writerow({k:str(v).encode('utf-8').decode('utf-8') for k, v in player.items()})
+    with open(filename, 'w+', encoding='utf8', newline='') as f:
+        w = csv.DictWriter(f, sorted(list_of_players[0]))
+        w.writeheader()
+        for player in list_of_players:
+                w.writerow({k:str(v).encode('utf-8').decode('utf-8') for k, v in player.items()})
+    mirror_csv(filename)
 
 def parse_player_history(list_of_histories, base_filename, player_name, Id):
     if len(list_of_histories) > 0:
-        stat_names = extract_stat_names(list_of_histories[0])
         filename = base_filename + player_name + '_' + str(Id) + '/history.csv'
         os.makedirs(os.path.dirname(filename), exist_ok=True)
-        f = open(filename, 'w+', encoding='utf8', newline='')
-        w = csv.DictWriter(f, sorted(stat_names))
-        w.writeheader()
-        for history in list_of_histories:
-            w.writerow(history)
+        with open(filename, 'w+', encoding='utf8', newline='') as f:
+            w = csv.DictWriter(f, sorted(list_of_histories[0]))
+            w.writeheader()
+            w.writerows(list_of_histories)
 
 def parse_player_gw_history(list_of_gw, base_filename, player_name, Id):
     if len(list_of_gw) > 0:
-        stat_names = extract_stat_names(list_of_gw[0])
         filename = base_filename + player_name + '_' + str(Id) + '/gw.csv'
         os.makedirs(os.path.dirname(filename), exist_ok=True)
-        f = open(filename, 'w+', encoding='utf8', newline='')
-        w = csv.DictWriter(f, sorted(stat_names))
-        w.writeheader()
+        with open(filename, 'w+', encoding='utf8', newline='') as f:
+            w = csv.DictWriter(f, sorted(list_of_gw[0]))
+            w.writeheader()
+            w.writerows(list_of_gw)
+        mirror_csv(filename)
+
+def append_player_gw_history(list_of_gw, base_filename, player_name, Id):
+    """ Bring an existing gw.csv up to date without rewriting the whole file
+
+    Rows already on disk are kept up to the last round they cover. That round is
+    rewritten, since its bonus points can still change, and every later round in
+    list_of_gw is appended after it. Falls back to a full write when the file is
+    missing or its columns no longer match the api.
+    """
+    if len(list_of_gw) == 0:
+        return
+    stat_names = sorted(list_of_gw[0])
+    filename = base_filename + player_name + '_' + str(Id) + '/gw.csv'
+    if not os.path.exists(filename):
+        return parse_player_gw_history(list_of_gw, base_filename, player_name, Id)
+    with open(filename, 'rb') as f:
+        lines = f.read().splitlines(keepends=True)
+    if len(lines) == 0 or next(csv.reader([lines[0].decode('utf8')])) != stat_names:
+        return parse_player_gw_history(list_of_gw, base_filename, player_name, Id)
+    round_idx = stat_names.index('round')
+    offset = len(lines[0])
+    last_round = None
+    last_round_offset = offset
+    for line in lines[1:]:
+        row_round = int(next(csv.reader([line.decode('utf8')]))[round_idx])
+        if row_round != last_round:
+            last_round = row_round
+            last_round_offset = offset
+        offset += len(line)
+    with open(filename, 'r+', encoding='utf8', newline='') as f:
+        f.seek(last_round_offset)
+        f.truncate()
+        w = csv.DictWriter(f, stat_names)
         for gw in list_of_gw:
-            w.writerow(gw)
+            if last_round is None or int(gw['round']) >= last_round:
+                w.writerow(gw)
+    mirror_csv(filename)
+
+def parse_player_snapshot(list_of_players, base_filename, fields):
+    """ Record the bootstrap-static fields used to spot which players changed between runs
+    """
+    filename = base_filename + 'players_snapshot.csv'
+    with open(filename, 'w+', encoding='utf8', newline='') as f:
+        w = csv.DictWriter(f, ['id'] + fields, extrasaction='ignore')
+        w.writeheader()
+        for player in list_of_players:
+            w.writerow(player)
 
 def parse_gw_entry_history(data, outfile_base):
     for gw in data:
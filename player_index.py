@@ -0,0 +1,137 @@
+import os
+import sys
+
+import pandas as pd
+from storage import read_table, write_table
+
+INDEX_FILENAME = 'player_index.csv'
+INDEX_COLUMNS = ['code', 'season', 'element', 'understat_id']
+
+def season_folders(data_dir='data'):
+    """ Season folders under data_dir that have a players_raw.csv, oldest first
+    """
+    return sorted(entry.name for entry in os.scandir(data_dir)
+                  if entry.is_dir() and os.path.exists(os.path.join(entry.path, 'players_raw.csv')))
+
+def read_player_codes(season_path):
+    """ The element id and stable code of every player in a season's players_raw.csv
+    """
+    filename = os.path.join(season_path, 'players_raw.csv')
+    try:
+        return pd.read_csv(filename, usecols=['id', 'code'], encoding='utf-8')
+    except UnicodeDecodeError:
+        return pd.read_csv(filename, usecols=['id', 'code'], encoding='latin-1')
+
+def read_understat_ids(season_path):
+    """ Understat id of each FPL element id matched in a season's id_dict.csv, if it has one
+    """
+    filename = os.path.join(season_path, 'id_dict.csv')
+    if not os.path.exists(filename):
+        return pd.Series(dtype='int64')
+    # id_dict.csv's header has a space after every comma
+    df = pd.read_csv(filename, skipinitialspace=True, usecols=['Understat_ID', 'FPL_ID'])
+    df = df[(df['Understat_ID'] >= 0) & (df['FPL_ID'] >= 0)]
+    return df.drop_duplicates('FPL_ID').set_index('FPL_ID')['Understat_ID']
+
+def build_player_index(data_dir='data'):
+    """ Write the cross-season player identity table to data_dir/player_index.csv
+
+    There is one row per player per season, keyed by the `code` players_raw.csv keeps
+    for a player across seasons, with that season's element id. Understat ids are
+    stable across seasons too, so the id matched in any season's id_dict.csv is given
+    to every season of that player, the most recent match winning on a conflict.
+    """
+    frames = []
+    for season in season_folders(data_dir):
+        season_path = os.path.join(data_dir, season)
+        players = read_player_codes(season_path)
+        understat_ids = read_understat_ids(season_path)
+        frames += [pd.DataFrame({
+            'code': players['code'],
+            'season': season,
+            'element': players['id'],
+            'understat_id': players['id'].map(understat_ids).fillna(-1).astype('int64'),
+        })]
+    df = pd.concat(frames, ignore_index=True)
+    matched = df[df['understat_id'] >= 0].groupby('code')['understat_id'].last()
+    df['understat_id'] = df['code'].map(matched).fillna(-1).astype('int64')
+    df = df.sort_values(['code', 'season'], kind='mergesort')[INDEX_COLUMNS]
+    write_table(df, os.path.join(data_dir, INDEX_FILENAME))
+    return df
+
+def index_sources(data_dir='data'):
+    """ The players_raw.csv and id_dict.csv files the index is built from
+    """
+    sources = []
+    for season in season_folders(data_dir):
+        for filename in ('players_raw.csv', 'id_dict.csv'):
+            path = os.path.join(data_dir, season, filename)
+            if os.path.exists(path):
+                sources += [path]
+    return sources
+
+def fresh_index_path(data_dir='data'):
+    """ Path of player_index.csv if it is at least as new as every file it is built from, else None
+    """
+    path = os.path.join(data_dir, INDEX_FILENAME)
+    if not os.path.exists(path):
+        return None
+    built = os.path.getmtime(path)
+    if any(os.path.getmtime(source) > built for source in index_sources(data_dir)):
+        return None
+    return path
+
+class PlayerIndex:
+    """ Lookups from FPL element ids and Understat ids to one canonical integer key
+
+    The key is the players_raw.csv `code`, which unlike the element id stays the same
+    for a player from season to season, so frames from different seasons or from
+    Understat can be joined on it instead of on cleaned-up names.
+
+    Args:
+        data_dir (str): Folder holding the season folders and player_index.csv, which
+            is rebuilt first if it is missing or older than a players_raw.csv or id_dict.csv
+    """
+    def __init__(self, data_dir='data'):
+        filename = os.path.join(data_dir, INDEX_FILENAME)
+        if fresh_index_path(data_dir) is None:
+            build_player_index(data_dir)
+        self.df = read_table(filename)
+        self.codes = self.df.set_index(['season', 'element'])['code']
+        understat = self.df[self.df['understat_id'] >= 0].drop_duplicates('understat_id')
+        self.understat_codes = understat.set_index('understat_id')['code']
+        self.code_rows = self.df.groupby('code', sort=False).indices
+
+    def code(self, season, element):
+        """ Canonical key of a season's element id, or -1 if the index doesn't have it
+        """
+        return int(self.codes.get((season, element), -1))
+
+    def understat_code(self, understat_id):
+        return int(self.understat_codes.get(understat_id, -1))
+
+    def elements(self, code):
+        """ Element id of the player in every season they appear in, by season
+        """
+        rows = self.code_rows.get(code, [])
+        seasons = self.df.iloc[rows]
+        return dict(zip(seasons['season'], seasons['element']))
+
+    def map_codes(self, seasons, elements):
+        """ Canonical keys for aligned season and element id columns, -1 where unknown
+        """
+        keys = pd.MultiIndex.from_arrays([pd.Series(seasons).astype(str), pd.Series(elements)])
+        return self.codes.reindex(keys).fillna(-1).astype('int64').to_numpy()
+
+    def map_understat_codes(self, understat_ids):
+        """ Canonical keys for a column of Understat ids, -1 where unknown
+        """
+        return pd.Series(understat_ids).map(self.understat_codes).fillna(-1).astype('int64').to_numpy()
+
+def main():
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else 'data'
+    df = build_player_index(data_dir)
+    print("Indexed %d players over %d seasons" % (df['code'].nunique(), df['season'].nunique()))
+
+if __name__ == '__main__':
+    main()
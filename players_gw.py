@@ -0,0 +1,145 @@
+import csv
+import os
+import sys
+
+import pandas as pd
+from storage import mirror_csv, read_table
+
+TABLE_FILENAME = 'players_gw.csv'
+KEY_COLUMNS = ['player_id', 'player_name']
+
+def read_player_gw_rows(filename):
+    """ Rows of an existing players_gw.csv, or of a single player's gw.csv
+    """
+    with open(filename, 'r', encoding='utf8', newline='') as f:
+        reader = csv.DictReader(f)
+        return reader.fieldnames, list(reader)
+
+def write_player_gws(player_gws, base_filename, keep_existing=False):
+    """ Write one season-wide table of every player's gameweek rows
+
+    Rows are sorted by player_id and keep the api's round order within each
+    player, so a player's rows sit next to each other on disk.
+
+    Args:
+        player_gws (dict): Player id to a (player_name, list_of_gw) tuple
+        base_filename (str): Season folder, e.g. 'data/2021-22/'
+        keep_existing (bool): Keep the rows of players that aren't in player_gws from
+            the table already on disk, for incremental runs. The table is first built
+            from the players/ tree if there isn't one yet, so it is never left holding
+            only the players of this run
+    """
+    filename = os.path.join(base_filename, TABLE_FILENAME)
+    if keep_existing and not os.path.exists(filename):
+        build_player_gws(base_filename)
+    stat_names = set()
+    rows = []
+    if keep_existing and os.path.exists(filename):
+        fieldnames, existing = read_player_gw_rows(filename)
+        stat_names.update(f for f in fieldnames if f not in KEY_COLUMNS)
+        rows += [row for row in existing if int(row['player_id']) not in player_gws]
+    for player_id, (player_name, list_of_gw) in player_gws.items():
+        for gw in list_of_gw:
+            stat_names.update(gw.keys())
+            row = dict(gw)
+            row['player_id'] = player_id
+            row['player_name'] = player_name.replace('_', ' ')
+            rows += [row]
+    if len(rows) == 0:
+        return
+    rows.sort(key=lambda row: int(row['player_id']))
+    with open(filename, 'w+', encoding='utf8', newline='') as f:
+        w = csv.DictWriter(f, KEY_COLUMNS + sorted(stat_names), restval='')
+        w.writeheader()
+        for row in rows:
+            w.writerow(row)
+    mirror_csv(filename)
+
+def build_player_gws(base_filename):
+    """ Backfill the season-wide table from an existing players/<name>_<id>/gw.csv tree
+    """
+    player_gws = {}
+    player_dir = os.path.join(base_filename, 'players')
+    for entry in os.scandir(player_dir):
+        fpath = os.path.join(entry.path, 'gw.csv')
+        if not entry.is_dir() or not os.path.exists(fpath):
+            continue
+        name, _, player_id = entry.name.rpartition('_')
+        fieldnames, rows = read_player_gw_rows(fpath)
+        player_gws[int(player_id)] = (name, rows)
+    write_player_gws(player_gws, base_filename)
+
+def read_player_gws_text(base_filename):
+    """ The season-wide table with every value kept as the exact text in the csv,
+    building the table from the players/ tree first if it doesn't exist yet
+    """
+    filename = os.path.join(base_filename, TABLE_FILENAME)
+    if not os.path.exists(filename):
+        build_player_gws(base_filename)
+    return pd.read_csv(filename, dtype=object, keep_default_na=False, encoding='utf8')
+
+class RowIndex:
+    """ Row positions of every value of a column, built once so fetching the rows for
+    one value is a dictionary lookup and costs the size of the slice rather than a
+    scan of the whole frame
+
+    Args:
+        df (DataFrame): Frame to index
+        column (str): Column whose values are looked up
+        sort (bool): Keep the values in sorted order, else in order of first appearance
+    """
+    def __init__(self, df, column, sort=False):
+        self.df = df
+        self.rows = df.groupby(column, sort=sort).indices
+
+    def keys(self):
+        return list(self.rows)
+
+    def get(self, value):
+        rows = self.rows.get(value)
+        if rows is None:
+            return self.df.iloc[0:0]
+        return self.df.iloc[rows]
+
+class PlayerGameweekTable:
+    """ A season's player gameweek rows with lookups by player and by round
+
+    The table is loaded once and the row positions for each player and each round
+    are indexed up front, so fetching one player or one round is a dictionary
+    lookup rather than a directory walk or a scan of the whole frame.
+
+    Args:
+        base_filename (str): Season folder holding players_gw.csv
+    """
+    def __init__(self, base_filename):
+        df = read_table(os.path.join(base_filename, TABLE_FILENAME))
+        self.df = df.sort_values(['player_id', 'round'], kind='mergesort').reset_index(drop=True)
+        self.player_index = RowIndex(self.df, 'player_id')
+        self.round_index = RowIndex(self.df, 'round', sort=True)
+
+    @property
+    def player_ids(self):
+        return self.player_index.keys()
+
+    @property
+    def rounds(self):
+        return self.round_index.keys()
+
+    def player(self, player_id):
+        return self.player_index.get(player_id)
+
+    def round(self, gw):
+        return self.round_index.get(gw)
+
+    def rows(self, player_id, gw):
+        df = self.player(player_id)
+        return df[df['round'] == gw]
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python players_gw.py <season_folder>. Eg: python players_gw.py data/2021-22/")
+        sys.exit(1)
+    build_player_gws(sys.argv[1])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import os
+import sys
+
+import pandas as pd
+
+# Columnar format written next to (or instead of) the csvs: 'csv' for none, 'parquet' or 'feather'.
+# Both columnar formats need pyarrow installed.
+STORAGE_FORMAT = os.environ.get('FPL_STORAGE_FORMAT', 'csv')
+# Whether tables written through write_table still get a csv when a columnar format is set
+KEEP_CSV = os.environ.get('FPL_KEEP_CSV', '1') != '0'
+COLUMNAR_FORMATS = ('parquet', 'feather')
+
+def configure(storage_format='csv', keep_csv=True):
+    """ Choose the storage backend for the rest of the run
+
+    Args:
+        storage_format (str): 'csv', 'parquet' or 'feather'
+        keep_csv (bool): Also write csvs for tables written through write_table
+    """
+    global STORAGE_FORMAT, KEEP_CSV
+    if storage_format != 'csv' and storage_format not in COLUMNAR_FORMATS:
+        raise ValueError("Unknown storage format " + storage_format)
+    STORAGE_FORMAT = storage_format
+    KEEP_CSV = keep_csv
+
+def columnar_path(csv_path, storage_format=None):
+    """ Path of the columnar copy that sits next to `csv_path`
+    """
+    storage_format = storage_format or STORAGE_FORMAT
+    return os.path.splitext(csv_path)[0] + '.' + storage_format
+
+def write_columnar(df, path, storage_format=None):
+    storage_format = storage_format or STORAGE_FORMAT
+    if storage_format == 'parquet':
+        df.to_parquet(path, index=False)
+    else:
+        df.reset_index(drop=True).to_feather(path)
+
+def read_columnar(path, columns=None):
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_feather(path, columns=columns)
+
+def write_table(df, csv_path, index=False, **csv_kwargs):
+    """ Write a frame with the configured backend
+
+    The columnar copy holds the same columns read_csv would give back for the csv,
+    so readers see identical frames whichever file they end up loading.
+    """
+    if STORAGE_FORMAT == 'csv' or KEEP_CSV:
+        df.to_csv(csv_path, index=index, **csv_kwargs)
+    if STORAGE_FORMAT != 'csv':
+        if index:
+            df = df.reset_index()
+            if df.columns[0] == 'index':
+                df = df.rename(columns={'index': 'Unnamed: 0'})
+        write_columnar(df, columnar_path(csv_path))
+
+def mirror_csv(csv_path, **read_kwargs):
+    """ Write a columnar copy of a csv produced by the csv module, when one is configured
+    """
+    if STORAGE_FORMAT == 'csv':
+        return
+    write_columnar(pd.read_csv(csv_path, **read_kwargs), columnar_path(csv_path))
+
+def fresh_columnar_path(csv_path):
+    """ The columnar copy of `csv_path` if there is one at least as new as the csv, else None
+    """
+    for storage_format in COLUMNAR_FORMATS:
+        path = columnar_path(csv_path, storage_format)
+        if not os.path.exists(path):
+            continue
+        if not os.path.exists(csv_path) or os.path.getmtime(path) >= os.path.getmtime(csv_path):
+            return path
+    return None
+
+def read_table(csv_path, usecols=None, **read_kwargs):
+    """ Read a table, preferring its typed columnar copy over re-parsing the csv
+
+    Args:
+        csv_path (str): Path of the csv. A .parquet or .feather file with the same name
+            is used instead when it is at least as new
+        usecols (list): Only load these columns, or a callable picking them by name
+        read_kwargs: Passed to pd.read_csv when falling back to the csv
+    """
+    path = fresh_columnar_path(csv_path)
+    if path is not None:
+        if callable(usecols):
+            df = read_columnar(path)
+            return df[[c for c in df.columns if usecols(c)]]
+        return read_columnar(path, columns=usecols)
+    return pd.read_csv(csv_path, usecols=usecols, **read_kwargs)
+
+def convert_csv(csv_path, storage_format, **read_kwargs):
+    """ Build a columnar copy of an existing csv, e.g. to backfill old seasons
+    """
+    write_columnar(pd.read_csv(csv_path, **read_kwargs), columnar_path(csv_path, storage_format), storage_format)
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: python storage.py <parquet|feather> <csv_path> [<csv_path> ...]")
+        sys.exit(1)
+    for csv_path in sys.argv[2:]:
+        try:
+            convert_csv(csv_path, sys.argv[1])
+        except UnicodeDecodeError:
+            convert_csv(csv_path, sys.argv[1], encoding='latin-1')
+
+if __name__ == '__main__':
+    main()
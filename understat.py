@@ -1,17 +1,22 @@
-import requests
+import asyncio
 import json
 from bs4 import BeautifulSoup
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import re
 import codecs
 import pandas as pd
 import os
 import csv
+import html
+import unicodedata
+from getters import get_text
+
+JSON_VAR_PATTERN = re.compile(r"var\s+(\w+)\s*=\s*JSON\.parse\('([^']*)'\)")
 
 def get_data(url):
-    response = requests.get(url)
-    if response.status_code != 200:
-        raise Exception("Response was code " + str(response.status_code))
-    html = response.text
+    return extract_scripts(get_text(url))
+
+def extract_scripts(html):
     parsed_html = BeautifulSoup(html, 'html.parser')
     scripts = parsed_html.findAll('script')
     filtered_scripts = []
@@ -20,48 +25,63 @@ def get_data(url):
             filtered_scripts += [script]
     return scripts
 
+def extract_json_vars(html, names):
+    """ Pull the `var name = JSON.parse('...')` blobs for the given names straight out
+    of the raw page in a single pass, without building a parse tree
+
+    Args:
+        html (str): Raw Understat page
+        names (tuple): Javascript variable names to extract, e.g. 'teamsData'
+    """
+    found = {}
+    for match in JSON_VAR_PATTERN.finditer(html):
+        name = match.group(1)
+        if name in names and name not in found:
+            decoded_content = codecs.escape_decode(match.group(2), "hex")[0].decode('utf-8')
+            found[name] = json.loads(decoded_content)
+    return found
+
 def get_epl_data():
-    scripts = get_data("https://understat.com/league/EPL/2021")
-    teamData = {}
-    playerData = {}
-    for script in scripts:
-        for c in script.contents:
-            split_data = c.split('=')
-            data = split_data[0].strip()
-            if data == 'var teamsData':
-                content = re.findall(r'JSON\.parse\(\'(.*)\'\)',split_data[1])
-                decoded_content = codecs.escape_decode(content[0], "hex")[0].decode('utf-8')
-                teamData = json.loads(decoded_content)
-            elif data == 'var playersData':
-                content = re.findall(r'JSON\.parse\(\'(.*)\'\)',split_data[1])
-                decoded_content = codecs.escape_decode(content[0], "hex")[0].decode('utf-8')
-                playerData = json.loads(decoded_content)
-    return teamData, playerData
+    data = extract_json_vars(get_text("https://understat.com/league/EPL/2021"), ('teamsData', 'playersData'))
+    return data.get('teamsData', {}), data.get('playersData', {})
 
 def get_player_data(id):
-    scripts = get_data("https://understat.com/player/" + str(id))
-    groupsData = {}
-    matchesData = {}
-    shotsData = {}
-    for script in scripts:
-        for c in script.contents:
-            split_data = c.split('=')
-            data = split_data[0].strip()
-            if data == 'var matchesData':
-                content = re.findall(r'JSON\.parse\(\'(.*)\'\)',split_data[1])
-                decoded_content = codecs.escape_decode(content[0], "hex")[0].decode('utf-8')
-                matchesData = json.loads(decoded_content)
-            elif data == 'var shotsData':
-                content = re.findall(r'JSON\.parse\(\'(.*)\'\)',split_data[1])
-                decoded_content = codecs.escape_decode(content[0], "hex")[0].decode('utf-8')
-                shotsData = json.loads(decoded_content)
-            elif data == 'var groupsData':
-                content = re.findall(r'JSON\.parse\(\'(.*)\'\)',split_data[1])
-                decoded_content = codecs.escape_decode(content[0], "hex")[0].decode('utf-8')
-                groupsData = json.loads(decoded_content)
-    return matchesData, shotsData, groupsData
-
-def parse_epl_data(outfile_base):
+    return extract_player_data(get_text(player_url(id)))
+
+def player_url(id):
+    return "https://understat.com/player/" + str(id)
+
+def extract_player_data(html):
+    """ Pull the matches, shots and groups data out of an Understat player page
+    """
+    data = extract_json_vars(html, ('matchesData', 'shotsData', 'groupsData'))
+    return data.get('matchesData', {}), data.get('shotsData', {}), data.get('groupsData', {})
+
+async def get_players_data(ids, workers=8, processes=None):
+    """ Fetch and parse many Understat player pages concurrently
+
+    Pages are downloaded over the shared pooled session with at most `workers`
+    requests in flight, and parsed in a process pool so parsing isn't held up by
+    the GIL.
+
+    Args:
+        ids (list): Understat player ids
+        workers (int): Number of page downloads allowed in flight at once
+        processes (int): Size of the parsing process pool, None for one per core
+
+    Returns:
+        list of (matchesData, shotsData, groupsData) tuples in the order of ids
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(workers)
+    with ThreadPoolExecutor(max_workers=workers) as io_pool, ProcessPoolExecutor(max_workers=processes) as cpu_pool:
+        async def fetch_and_parse(id):
+            async with semaphore:
+                html = await loop.run_in_executor(io_pool, get_text, player_url(id))
+            return await loop.run_in_executor(cpu_pool, extract_player_data, html)
+        return await asyncio.gather(*(fetch_and_parse(id) for id in ids))
+
+def parse_epl_data(outfile_base, workers=8, processes=None):
     teamData,playerData = get_epl_data()
     new_team_data = []
     for t,v in teamData.items():
@@ -72,53 +92,182 @@ def parse_epl_data(outfile_base):
         team_frame.to_csv(os.path.join(outfile_base, 'understat_' + team + '.csv'), index=False)
     player_frame = pd.DataFrame.from_records(playerData)
     player_frame.to_csv(os.path.join(outfile_base, 'understat_player.csv'), index=False)
-    for d in playerData:
-        matches, shots, groups = get_player_data(int(d['id']))
+    players = asyncio.run(get_players_data([int(d['id']) for d in playerData], workers, processes))
+    for d, (matches, shots, groups) in zip(playerData, players):
         indi_player_frame = pd.DataFrame.from_records(matches)
         player_name = d['player_name']
         player_name = player_name.replace(' ', '_')
         indi_player_frame.to_csv(os.path.join(outfile_base, player_name + '_' + d['id'] + '.csv'), index=False)
 
+# Understat club names that differ from the FPL short names in teams.csv
+TEAM_ALIASES = {
+    'Manchester United': 'Man Utd',
+    'Manchester City': 'Man City',
+    'Tottenham': 'Spurs',
+    'Wolverhampton Wanderers': 'Wolves',
+    'Newcastle United': 'Newcastle',
+    'Sheffield United': 'Sheffield Utd',
+    'West Bromwich Albion': 'West Brom',
+}
+MATCH_THRESHOLD = 0.5
+UNBLOCKED_MATCH_THRESHOLD = 0.75
+
 class PlayerID:
-    def __init__(self, us_id, fpl_id, us_name, fpl_name):
+    def __init__(self, us_id, fpl_id, us_name, fpl_name, confidence=0.0):
         self.us_id = str(us_id)
         self.fpl_id = str(fpl_id)
         self.us_name = us_name
         self.fpl_name = fpl_name
-        
-
-def match_ids(understat_dir, data_dir):
-    with open(os.path.join(understat_dir, 'understat_player.csv')) as understat_file:
-        understat_inf = csv.DictReader(understat_file)
-        ustat_players = {}
-        for row in understat_inf:
-            ustat_players[row['player_name']] = row['id']
-
-    with open(os.path.join(data_dir, 'player_idlist.csv')) as fpl_file:
-        fpl_players = {}
-        fpl_inf = csv.DictReader(fpl_file)
-        for row in fpl_inf:
-            fpl_players[row['first_name'] + ' ' + row['second_name']] = row['id']
+        self.confidence = confidence
+
+class NameKey:
+    """ The word set and character trigrams of a normalized name, for similarity scoring
+    """
+    def __init__(self, name):
+        name = unicodedata.normalize('NFKD', html.unescape(name))
+        name = ''.join(ch for ch in name if not unicodedata.combining(ch)).lower()
+        for ch in "-'.":
+            name = name.replace(ch, ' ')
+        self.words = frozenset(name.split())
+        padded = ' ' + ' '.join(sorted(self.words)) + ' '
+        self.grams = frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+    def similarity(self, other):
+        """ The larger of the share of the shorter name's words found in the other name
+        and the Dice coefficient of the two trigram sets, paired with the Dice coefficient
+        to break ties such as a lone first name contained in several full names
+        """
+        if not self.words or not other.words:
+            return 0.0, 0.0
+        words = len(self.words & other.words) / min(len(self.words), len(other.words))
+        grams = 2 * len(self.grams & other.grams) / (len(self.grams) + len(other.grams))
+        return max(words, grams), grams
+
+def read_understat_players(understat_dir):
+    """ Understat players of a season with the FPL names of their clubs and whether they
+    keep goal. Players only ever listed as a substitute ('S') could be either
+    """
     players = []
-    found = {}
-    for k, v in ustat_players.items():
-        if k in fpl_players:
-            player = PlayerID(v, fpl_players[k], k, k)
-            players += [player]
-            found[k] = True
-        else:
-            player = PlayerID(v, -1, k, "")
-            players += [player]
+    with open(os.path.join(understat_dir, 'understat_player.csv'), encoding='utf-8') as understat_file:
+        for row in csv.DictReader(understat_file):
+            positions = set(row['position'].split()) - {'S'}
+            players += [{
+                'id': row['id'],
+                'name': row['player_name'],
+                'teams': {TEAM_ALIASES.get(team, team) for team in row['team_title'].split(',')},
+                'keepers': {'GK' in positions} if positions else {True, False},
+                'keys': [NameKey(row['player_name'])],
+            }]
+    return players
+
+def read_fpl_players(data_dir):
+    """ FPL players of a season with their club name, whether they keep goal, and
+    their full and web names
+    """
+    teams = {}
+    if os.path.exists(os.path.join(data_dir, 'teams.csv')):
+        with open(os.path.join(data_dir, 'teams.csv'), encoding='utf-8') as teams_file:
+            teams = {row['id']: row['name'] for row in csv.DictReader(teams_file)}
+    players = []
+    with open(os.path.join(data_dir, 'players_raw.csv'), encoding='utf-8') as fpl_file:
+        for row in csv.DictReader(fpl_file):
+            name = row['first_name'] + ' ' + row['second_name']
+            players += [{
+                'id': row['id'],
+                'name': name,
+                'teams': {teams.get(row['team'])},
+                'keeper': row['element_type'] == '1',
+                'keys': [NameKey(name), NameKey(row['web_name'])],
+            }]
+    return players
+
+def score_block(ustat_players, fpl_players, threshold):
+    """ Pick one-to-one matches within a block, best scoring pairs first
 
-    for k, v in fpl_players.items():
-        if k not in found:
-            player = PlayerID(-1, v, "", k)
-            players += [player]
+    Returns:
+        A list of (score, understat index, fpl index) for the accepted pairs
+    """
+    pairs = []
+    for i, us in ustat_players:
+        for j, fpl in fpl_players:
+            score = max(us_key.similarity(fpl_key) for us_key in us['keys'] for fpl_key in fpl['keys'])
+            if score[0] >= threshold:
+                pairs += [(score, i, j)]
+    pairs.sort(key=lambda pair: pair[0], reverse=True)
+    matched = []
+    used_us = set()
+    used_fpl = set()
+    for score, i, j in pairs:
+        if i not in used_us and j not in used_fpl:
+            matched += [(score[0], i, j)]
+            used_us.add(i)
+            used_fpl.add(j)
+    return matched
+
+def match_players(ustat_players, fpl_players):
+    """ Link Understat players to FPL players by name, comparing only players at the
+    same club and on the same side of the goalkeeper/outfield split
+
+    Players left over, e.g. after a transfer the two sites record differently, get a
+    second pass against every unmatched player with a stricter threshold.
+
+    Returns:
+        A dict of understat index to a (fpl index, confidence) tuple
+    """
+    blocks = {}
+    for i, us in enumerate(ustat_players):
+        for team in us['teams']:
+            for keeper in us['keepers']:
+                blocks.setdefault((team, keeper), ([], []))[0].append((i, us))
+    for j, fpl in enumerate(fpl_players):
+        for team in fpl['teams']:
+            if (team, fpl['keeper']) in blocks:
+                blocks[(team, fpl['keeper'])][1].append((j, fpl))
+    matches = {}
+    used_fpl = set()
+    for block_us, block_fpl in blocks.values():
+        block_us = [(i, us) for i, us in block_us if i not in matches]
+        block_fpl = [(j, fpl) for j, fpl in block_fpl if j not in used_fpl]
+        for score, i, j in score_block(block_us, block_fpl, MATCH_THRESHOLD):
+            matches[i] = (j, score)
+            used_fpl.add(j)
+    for keeper in (True, False):
+        rest_us = [(i, us) for i, us in enumerate(ustat_players) if i not in matches and keeper in us['keepers']]
+        rest_fpl = [(j, fpl) for j, fpl in enumerate(fpl_players) if j not in used_fpl and fpl['keeper'] == keeper]
+        for score, i, j in score_block(rest_us, rest_fpl, UNBLOCKED_MATCH_THRESHOLD):
+            matches[i] = (j, score)
+            used_fpl.add(j)
+    return matches
+
+def match_ids(understat_dir, data_dir, outfile=None):
+    """ Write id_dict.csv linking each Understat player to an FPL player, with the
+    confidence of the name match. Players with no match get an id of -1
+
+    Args:
+        understat_dir (str): Folder holding the season's understat_player.csv
+        data_dir (str): Season folder holding players_raw.csv and teams.csv
+        outfile (str): Where to write, data_dir/id_dict.csv if None
+    """
+    ustat_players = read_understat_players(understat_dir)
+    fpl_players = read_fpl_players(data_dir)
+    matches = match_players(ustat_players, fpl_players)
+    players = []
+    for i, us in enumerate(ustat_players):
+        if i in matches:
+            j, score = matches[i]
+            players += [PlayerID(us['id'], fpl_players[j]['id'], us['name'], fpl_players[j]['name'], score)]
+        else:
+            players += [PlayerID(us['id'], -1, us['name'], "")]
+    found = {j for j, score in matches.values()}
+    for j, fpl in enumerate(fpl_players):
+        if j not in found:
+            players += [PlayerID(-1, fpl['id'], "", fpl['name'])]
 
-    with open(os.path.join(data_dir, 'id_dict.csv'), 'w+') as outf:
-        outf.write('Understat_ID, FPL_ID, Understat_Name, FPL_Name\n')
+    with open(outfile or os.path.join(data_dir, 'id_dict.csv'), 'w+', encoding='utf-8') as outf:
+        outf.write('Understat_ID, FPL_ID, Understat_Name, FPL_Name, Confidence\n')
         for p in players:
-            outf.write(p.us_id + "," + p.fpl_id + "," + p.us_name + "," + p.fpl_name + "\n")
+            outf.write(p.us_id + "," + p.fpl_id + "," + p.us_name + "," + p.fpl_name + "," + "%.3f" % p.confidence + "\n")
+    return players
 
 def main():
     #parse_epl_data('data/2021-22/understat')